@@ -1,71 +1,477 @@
+import math
 import os
+import re
 import sqlite3
-from typing import List, Dict, Any, Optional, Tuple
+import threading
+import time
+from contextlib import nullcontext
+from typing import Callable, List, Dict, Any, Iterator, Optional, Tuple
+from urllib.request import pathname2url
+
+from ResultCache import ResultCache
+
+# Statements that may be served by a read-only pooled connection
+READ_ONLY_PREFIXES = ("SELECT", "WITH", "VALUES", "EXPLAIN")
+
+# Authorizer actions allowed while a read statement runs: anything else is a write
+READ_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+
+# Number of VM instructions between two checks of the query guardrails
+PROGRESS_INTERVAL = 1000
+
+# Words that can follow a table name without being its alias
+NOT_ALIASES = {
+    "where", "join", "inner", "left", "right", "full", "outer", "cross", "natural",
+    "on", "using", "group", "order", "having", "limit", "offset", "union", "intersect",
+    "except", "window", "indexed", "not", "as", "set", "values", "select", "from",
+}
+
+
+class QueryGuardError(RuntimeError):
+    """Raised when a query is rejected or aborted by DBManager's guardrails."""
+
+
+def _deny_writes(action: int, *args: Any) -> int:
+    return sqlite3.SQLITE_OK if action in READ_ACTIONS else sqlite3.SQLITE_DENY
+
+
+def _is_write_error(exc: sqlite3.DatabaseError) -> bool:
+    """Whether *exc* comes from a read statement that tried to write."""
+    return "not authorized" in str(exc) or "readonly" in str(exc)
 
 class DBManager:
-    """Handle SQLite database introspection and query execution."""
+    """Handle SQLite database introspection and query execution.
+
+    With ``pool=True`` read statements run on per-thread read-only
+    connections (``mode=ro``, plus ``immutable=1`` when the file is known not
+    to change) tuned with ``query_only``, ``mmap_size`` and ``cache_size``.
+    Everything else goes through the single writer connection under a lock,
+    so several threads can query one database concurrently. A statement
+    sent down the read path (``SELECT``, ``WITH``, ...) runs with every
+    write denied, so e.g. ``WITH x AS (...) DELETE ...`` fails with
+    :class:`QueryGuardError` unless the caller passes ``allow_write=True``.
+
+    Guardrails protect against runaway generated SQL: ``timeout`` (seconds)
+    and ``max_steps`` (SQLite VM instructions) abort a running query through
+    a progress handler, and ``explain_check`` rejects SELECTs whose
+    ``EXPLAIN QUERY PLAN`` fully scans a table, or cross joins tables, over
+    ``max_scan_rows`` rows. Both raise :class:`QueryGuardError`.
 
-    def __init__(self, db_path: str):
+    ``result_cache_bytes`` enables an LRU cache of SELECT results keyed by
+    the normalized SQL, dropped whenever ``PRAGMA data_version`` or the file
+    mtime changes; ``cache_stats()`` reports its hit/miss counters.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        pool: bool = False,
+        immutable: bool = False,
+        mmap_size: Optional[int] = None,
+        cache_size: Optional[int] = None,
+        timeout: Optional[float] = None,
+        max_steps: Optional[int] = None,
+        explain_check: bool = False,
+        max_scan_rows: int = 100_000,
+        result_cache_bytes: int = 0,
+    ):
         """Open a connection to the SQLite database."""
         self.db_path = db_path
-        self.conn = sqlite3.connect(self.db_path)
+        self.pool = pool
+        self.immutable = immutable
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self.max_steps = max_steps
+        self.explain_check = explain_check
+        self.max_scan_rows = max_scan_rows
+        self._row_counts: Dict[str, int] = {}
+        self.result_cache = ResultCache(result_cache_bytes) if result_cache_bytes > 0 else None
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=not pool)
         self.cursor = self.conn.cursor()
+        self._tune(self.conn)
+        self._write_lock = threading.RLock()
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+        self._catalog: Optional[Dict[str, Dict[str, Any]]] = None
+        self._schema_version: Optional[int] = None
 
     def extract_column_table_pairs(self) -> Dict[str, List[str]]:
         """Return a mapping of table names to their column names."""
-        result: Dict[str, List[str]] = {}
-        for table in self._get_tables():
-            columns = self._get_columns(table)
-            result[table] = [col["name"] for col in columns]
-        return result
+        return {
+            table: [col["name"] for col in meta["columns"]]
+            for table, meta in self.schema_catalog().items()
+        }
 
     def extract_table_metadata(self, table_name: str) -> Dict[str, Any]:
         """Return metadata (columns and foreign keys) for a table."""
+        meta = self.schema_catalog().get(table_name, {"columns": [], "foreign_keys": []})
         return {
-            "columns": self._get_columns(table_name),
-            "foreign_keys": self._get_foreign_keys(table_name),
+            "columns": [dict(col) for col in meta["columns"]],
+            "foreign_keys": [dict(fk) for fk in meta["foreign_keys"]],
         }
 
-    def _get_tables(self) -> List[str]:
-        self.cursor.execute(
-            "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%';"
-        )
-        return [row[0] for row in self.cursor.fetchall()]
-
-    def _get_columns(self, table: str) -> List[Dict[str, Any]]:
-        self.cursor.execute(f"PRAGMA table_info({table});")
-        return [
-            {
-                "name": col[1],
-                "type": col[2],
-                "not_null": bool(col[3]),
-                "default_value": col[4],
-                "primary_key": bool(col[5]),
-            }
-            for col in self.cursor.fetchall()
-        ]
-
-    def _get_foreign_keys(self, table: str) -> List[Dict[str, str]]:
-        self.cursor.execute(f"PRAGMA foreign_key_list({table});")
-        return [
-            {"from_column": fk[3], "to_table": fk[2], "to_column": fk[4]}
-            for fk in self.cursor.fetchall()
-        ]
-
-    def execute_query(self, query: str, params: Optional[Tuple[Any, ...]] = None) -> Any:
-        """Execute a SQL query and return results or affected row count."""
+    def schema_catalog(self) -> Dict[str, Dict[str, Any]]:
+        """Return columns and foreign keys of every table, introspected once.
+
+        The catalog is cached and only rebuilt when ``PRAGMA schema_version``
+        changes, so repeated lookups never re-query the schema tables.
+        """
+        with self._write_lock:
+            version = self.conn.execute("PRAGMA schema_version;").fetchone()[0]
+            if self._catalog is None or version != self._schema_version:
+                self._catalog = self._introspect()
+                self._schema_version = version
+                self._row_counts.clear()
+            return self._catalog
+
+    def _introspect(self) -> Dict[str, Dict[str, Any]]:
+        rows = self.conn.execute(
+            """
+            SELECT 0, m.rowid, m.name, p.cid, p.name, p.type, p."notnull", p.dflt_value, p.pk
+            FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p
+            WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%'
+            UNION ALL
+            SELECT 1, m.rowid, m.name, f.id * 1000 + f.seq, f."from", f."table", f."to", NULL, NULL
+            FROM sqlite_master AS m JOIN pragma_foreign_key_list(m.name) AS f
+            WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%'
+            ORDER BY 1, 2, 4;
+            """
+        ).fetchall()
+        # Column rows sort first, so tables keep their sqlite_master order
+        catalog: Dict[str, Dict[str, Any]] = {}
+        for kind, _, table, _, name, col_type, not_null, default, pk in rows:
+            meta = catalog.setdefault(table, {"columns": [], "foreign_keys": []})
+            if kind == 0:
+                meta["columns"].append({
+                    "name": name,
+                    "type": col_type,
+                    "not_null": bool(not_null),
+                    "default_value": default,
+                    "primary_key": bool(pk),
+                })
+            else:
+                meta["foreign_keys"].append(
+                    {"from_column": name, "to_table": col_type, "to_column": not_null}
+                )
+        return catalog
+
+    def _tune(self, conn: sqlite3.Connection) -> None:
+        if self.mmap_size is not None:
+            conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)};")
+        if self.cache_size is not None:
+            conn.execute(f"PRAGMA cache_size = {int(self.cache_size)};")
+
+    def _reader(self) -> sqlite3.Connection:
+        """Return the read-only connection of the calling thread."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            uri = f"file:{pathname2url(os.path.abspath(self.db_path))}?mode=ro"
+            if self.immutable:
+                uri += "&immutable=1"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            conn.execute("PRAGMA query_only = 1;")
+            self._tune(conn)
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    def is_read(self, query: str) -> bool:
+        """Whether *query* is a read statement (``SELECT``, ``WITH``, ``VALUES``, ``EXPLAIN``).
+
+        This only classifies by the leading keyword; reads are still run with
+        writes denied, so a ``WITH ... DELETE`` is caught when executed.
+        """
+        return query.lstrip().upper().startswith(READ_ONLY_PREFIXES)
+
+    def _read_only(self, conn: sqlite3.Connection, func: Callable[..., Any], *args: Any) -> Any:
+        """Call ``func`` with an authorizer denying every write on ``conn``."""
+        # Setting the authorizer expires prepared statements, so cached ones are re-checked
+        conn.set_authorizer(_deny_writes)
+        try:
+            return func(*args)
+        finally:
+            conn.set_authorizer(None)
+
+    def _guarded(self, conn: sqlite3.Connection, func: Callable[..., Any], *args: Any) -> Any:
+        """Call ``func`` with the timeout and step budget enforced on ``conn``."""
+        if self.timeout is None and self.max_steps is None:
+            return func(*args)
+        deadline = time.monotonic() + self.timeout if self.timeout is not None else None
+        state: Dict[str, Any] = {"steps": 0, "reason": None}
+
+        def check() -> int:
+            state["steps"] += PROGRESS_INTERVAL
+            if self.max_steps is not None and state["steps"] > self.max_steps:
+                state["reason"] = f"exceeded the budget of {self.max_steps} VM steps"
+            elif deadline is not None and time.monotonic() > deadline:
+                state["reason"] = f"exceeded the {self.timeout}s timeout"
+            return 1 if state["reason"] else 0
+
+        conn.set_progress_handler(check, PROGRESS_INTERVAL)
+        try:
+            return func(*args)
+        except sqlite3.OperationalError as exc:
+            if state["reason"]:
+                raise QueryGuardError(f"Query aborted: it {state['reason']}.") from exc
+            raise
+        finally:
+            conn.set_progress_handler(None, 0)
+
+    def explain_query(self, query: str, params: Optional[Tuple[Any, ...]] = None) -> List[str]:
+        """Return warnings about full scans of large tables and cross joins.
+
+        Uses ``EXPLAIN QUERY PLAN``: a ``SCAN`` of a table holding more than
+        ``max_scan_rows`` rows is flagged, as are several tables scanned in the
+        same loop nest whose row counts multiply past that limit.
+        """
+        conn = self._reader() if self.pool else self.conn
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {query}", params or ()).fetchall()
+        tables = {name.lower(): name for name in self.schema_catalog()}
+        aliases = self._aliases(query, tables)
+        scans: Dict[int, List[str]] = {}
+        for _, parent, _, detail in plan:
+            # Aliased tables are planned under their alias, e.g. "SCAN T1"
+            match = re.match(r"SCAN (?:TABLE )?(\S+)(?: AS (\S+))?", detail)
+            if not match:
+                continue
+            name = match.group(1).lower()
+            table = tables.get(name) or aliases.get(name) or aliases.get((match.group(2) or "").lower())
+            if table:
+                scans.setdefault(parent, []).append(table)
+
+        warnings = []
+        for scanned in scans.values():
+            counts = [self._row_count(table) for table in scanned]
+            for table, rows in zip(scanned, counts):
+                if rows > self.max_scan_rows:
+                    warnings.append(f"full scan of {table} ({rows} rows)")
+            combinations = math.prod(counts)
+            if len(scanned) > 1 and combinations > self.max_scan_rows:
+                warnings.append(f"cross join of {', '.join(scanned)} ({combinations} row combinations)")
+        return warnings
+
+    def _aliases(self, query: str, tables: Dict[str, str]) -> Dict[str, str]:
+        """Map the aliases declared in *query* (``table [AS] alias``) to their tables.
+
+        An alias reused for several tables maps to the largest one, so the
+        plan check errs on the side of flagging.
+        """
+        aliases: Dict[str, str] = {}
+        pattern = r'(?=\b(\w+)["`\]]?\s+(?:AS\s+)?["`\[]?(\w+)\b)'
+        for name, alias in re.findall(pattern, query, flags=re.IGNORECASE):
+            table, alias = tables.get(name.lower()), alias.lower()
+            if table is None or alias in NOT_ALIASES or alias in tables:
+                continue
+            if alias not in aliases or self._row_count(table) > self._row_count(aliases[alias]):
+                aliases[alias] = table
+        return aliases
+
+    def _row_count(self, table: str) -> int:
+        """Estimate the rows of *table* without scanning it.
+
+        Uses ``sqlite_stat1`` when ANALYZE has run, else ``max(rowid)``
+        (an index seek, and an upper bound once rows were deleted). Only
+        ``WITHOUT ROWID`` tables fall back to ``COUNT(*)``, under the
+        guardrails. Cached until this manager writes or the schema changes.
+        """
+        if table not in self._row_counts:
+            conn = self._reader() if self.pool else self.conn
+            quoted = table.replace('"', '""')
+            try:
+                stat = conn.execute(
+                    "SELECT stat FROM sqlite_stat1 WHERE tbl = ? ORDER BY idx IS NOT NULL LIMIT 1;", (table,)
+                ).fetchone()
+            except sqlite3.OperationalError:  # never analyzed
+                stat = None
+            if stat and stat[0]:
+                rows = int(str(stat[0]).split()[0])
+            else:
+                try:
+                    rows = conn.execute(f'SELECT max(rowid) FROM "{quoted}";').fetchone()[0] or 0
+                except sqlite3.OperationalError:  # WITHOUT ROWID
+                    rows = self._guarded(conn, conn.execute, f'SELECT COUNT(*) FROM "{quoted}";').fetchone()[0]
+            self._row_counts[table] = rows
+        return self._row_counts[table]
+
+    def _check_plan(self, query: str, params: Tuple[Any, ...]) -> None:
+        if not self.explain_check or not self.is_read(query):
+            return
+        if query.lstrip().upper().startswith("EXPLAIN"):
+            return
+        warnings = self.explain_query(query, params)
+        if warnings:
+            raise QueryGuardError("Query rejected: " + "; ".join(warnings) + ".")
+
+    def execute_query(
+        self,
+        query: str,
+        params: Optional[Tuple[Any, ...]] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        allow_write: bool = False,
+        read_only: bool = False,
+    ) -> Any:
+        """Execute a SQL query and return results or affected row count.
+
+        With ``limit`` only one page of rows is fetched (after skipping
+        ``offset`` rows) and ``has_more`` tells whether rows remain. A read
+        statement that tries to write raises :class:`QueryGuardError`; with
+        ``allow_write`` it is re-run on the writer connection instead.
+        ``read_only`` rejects every non-read statement and never writes.
+        """
         if params is None:
             params = ()
-        self.cursor.execute(query, params)
-        if self.cursor.description:  # SELECT-like query
-            columns = [col[0] for col in self.cursor.description]
-            rows = self.cursor.fetchall()
-            return {"columns": columns, "rows": rows}
-        else:
-            self.conn.commit()
-            return {"rowcount": self.cursor.rowcount}
+        if read_only:
+            if not self.is_read(query):
+                raise QueryGuardError("Query rejected: only read statements can be executed.")
+            allow_write = False
+        if self.result_cache is None or not self.is_read(query):
+            return self._execute(query, params, limit, offset, allow_write)
+        self.result_cache.validate(self._data_token())
+        key = self.result_cache.key(query, params, limit, offset)
+        result = self.result_cache.get(key)
+        if result is None:
+            result = self._execute(query, params, limit, offset, allow_write)
+            if "columns" in result:
+                self.result_cache.put(key, result)
+        return result
+
+    def _execute(
+        self,
+        query: str,
+        params: Tuple[Any, ...],
+        limit: Optional[int],
+        offset: int,
+        allow_write: bool = False,
+    ) -> Dict[str, Any]:
+        self._check_plan(query, params)
+        if self.is_read(query):
+            conn = self._reader() if self.pool else self.conn
+            try:
+                with nullcontext() if self.pool else self._write_lock:
+                    return self._read_only(
+                        conn, self._guarded, conn, self._run, conn.cursor(), query, params, limit, offset
+                    )
+            except sqlite3.DatabaseError as exc:
+                if not _is_write_error(exc):
+                    raise
+                if not allow_write:
+                    raise QueryGuardError("Query rejected: a read statement tried to write.") from exc
+                # e.g. a CTE feeding an INSERT: re-run on the writer
+        with self._write_lock:
+            result = self._guarded(self.conn, self._run, self.cursor, query, params, limit, offset)
+            if "rowcount" in result:
+                self.conn.commit()
+                self._invalidate()
+            return result
+
+    def _invalidate(self) -> None:
+        """Forget cached data after a write through this manager."""
+        self._row_counts.clear()
+        if self.result_cache is not None:
+            self.result_cache.clear()
+
+    def _data_token(self) -> Tuple[int, int]:
+        # data_version only moves for commits made by other connections
+        with self._write_lock:
+            version = self.conn.execute("PRAGMA data_version;").fetchone()[0]
+        return version, os.stat(self.db_path).st_mtime_ns
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """Return the result cache counters (empty when caching is disabled)."""
+        return self.result_cache.stats() if self.result_cache is not None else {}
+
+    def _run(
+        self,
+        cursor: sqlite3.Cursor,
+        query: str,
+        params: Tuple[Any, ...],
+        limit: Optional[int],
+        offset: int,
+    ) -> Dict[str, Any]:
+        cursor.execute(query, params)
+        if cursor.description:  # SELECT-like query
+            return self._collect(cursor, limit, offset)
+        return {"rowcount": cursor.rowcount}
+
+    def _collect(self, cursor: sqlite3.Cursor, limit: Optional[int], offset: int) -> Dict[str, Any]:
+        columns = [col[0] for col in cursor.description]
+        # Skip rows in bounded chunks so a large offset never materialises
+        remaining = offset
+        while remaining > 0:
+            skipped = len(cursor.fetchmany(min(remaining, 1000)))
+            if not skipped:
+                break
+            remaining -= skipped
+        if limit is None:
+            return {"columns": columns, "rows": cursor.fetchall()}
+        rows = cursor.fetchmany(limit + 1)
+        return {"columns": columns, "rows": rows[:limit], "has_more": len(rows) > limit}
+
+    def stream_query(
+        self,
+        query: str,
+        params: Optional[Tuple[Any, ...]] = None,
+        chunk_size: int = 500,
+        allow_write: bool = False,
+    ) -> Dict[str, Any]:
+        """Execute a SQL query and return its rows lazily.
+
+        SELECT-like queries return ``columns`` and ``chunks``, an iterator of
+        row lists fetched ``chunk_size`` at a time with ``fetchmany``. Other
+        statements, and with ``allow_write`` read statements that write,
+        behave like :meth:`execute_query`. Guardrail limits apply to the
+        initial execution and to each chunk separately.
+        """
+        if params is None:
+            params = ()
+        if self.is_read(query):
+            self._check_plan(query, params)
+            conn = self._reader() if self.pool else self.conn
+            try:
+                with nullcontext() if self.pool else self._write_lock:
+                    cursor = self._read_only(conn, self._guarded, conn, conn.execute, query, params)
+            except sqlite3.DatabaseError as exc:
+                if not _is_write_error(exc):
+                    raise
+                if not allow_write:
+                    raise QueryGuardError("Query rejected: a read statement tried to write.") from exc
+            else:
+                if cursor.description:
+                    columns = [col[0] for col in cursor.description]
+                    return {"columns": columns, "chunks": self._chunks(conn, cursor, chunk_size)}
+                return {"rowcount": cursor.rowcount}
+        result = self.execute_query(query, params, allow_write=allow_write)
+        if "rows" in result:
+            rows = result.pop("rows")
+            result["chunks"] = iter([rows[i : i + chunk_size] for i in range(0, len(rows), chunk_size)])
+        return result
+
+    def _chunks(
+        self, conn: sqlite3.Connection, cursor: sqlite3.Cursor, chunk_size: int
+    ) -> Iterator[List[Tuple[Any, ...]]]:
+        try:
+            while True:
+                rows = self._guarded(conn, cursor.fetchmany, chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+    def count_rows(self, query: str, params: Optional[Tuple[Any, ...]] = None) -> int:
+        """Return how many rows a SELECT-like *query* yields without fetching them."""
+        inner = query.strip().rstrip(";").strip()
+        return self.execute_query(f"SELECT COUNT(*) FROM ({inner})", params)["rows"][0][0]
 
     def close(self) -> None:
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
         self.conn.close()
 
 if __name__ == "__main__":
@@ -1,10 +1,60 @@
+import atexit
+import multiprocessing
 import os
-from typing import List
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
 import yake
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sentence_transformers import SentenceTransformer, util
-from sentence_transformers import CrossEncoder
 from rapidfuzz import process, fuzz
+from rapidfuzz.utils import default_process
+
+from EmbeddingCache import EmbeddingCache
+from MemoryStore import MemoryStore
+from ModelRegistry import ModelRegistry, get_registry
+from TfidfIndex import TfidfIndex
+
+# Below this many questions a process pool costs more than it saves
+MIN_POOL_BATCH = 32
+
+_worker_extractor = None
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+
+
+def _keyword_pool(workers: int) -> ProcessPoolExecutor:
+    """Process pool shared by every DialogModule, created on first use.
+
+    Workers are spawned rather than forked, so they do not copy a parent
+    that already holds torch and the embedder; they are only started once
+    and reused for every later batch.
+    """
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown()
+        else:
+            atexit.register(_shutdown_pool)
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        _pool_workers = workers
+    return _pool
+
+
+def _shutdown_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+def _extract_keywords(question: str) -> List[str]:
+    """Process-pool worker: YAKE keywords of one question."""
+    global _worker_extractor
+    if _worker_extractor is None:
+        _worker_extractor = yake.KeywordExtractor(lan='fr', top=15)
+    return [phrase for phrase, _ in _worker_extractor.extract_keywords(question)]
+
 
 class DialogModule:
     """Interactive helper to link user questions to the database schema, with three modes of matching."""
@@ -13,89 +63,236 @@ class DialogModule:
         self,
         schema_elements: List[str],
         memory_path: str = "data/dialog_memory.txt",
-        mode: str = 'normal'  # 'light', 'normal', or 'advanced'
+        mode: str = 'normal',  # 'light', 'normal', or 'advanced'
+        embedding_model: str = 'distiluse-base-multilingual-cased-v2',
+        cross_encoder_model: str = 'cross-encoder/quora-roberta-base',
+        device: Optional[str] = None,
+        registry: Optional[ModelRegistry] = None,
+        embedding_cache_dir: Optional[str] = "cache/embeddings",  # None disables the cache
+        rerank_top_k: Optional[int] = None,  # rerank only each phrase's semantic top-k
+        rerank_cache_size: int = 10_000,
+        keyword_cache_size: int = 2048,
+        embed_backend: str = "torch",  # see ModelRegistry.EMBED_BACKENDS, e.g. 'onnx-int8' on CPU
+        schema_dtype: str = "float32",  # 'float32', 'float16' or 'int8'
     ):
         self.schema_elements = schema_elements
         self.memory_path = memory_path
-        self.memory = self._load_memory()
+        self.store = MemoryStore(memory_path)
+        self.memory = self.store.lines
         self.mode = mode
+        # Lowercased, punctuation-free names for fuzzy matching, computed once
+        self.fuzzy_choices = [default_process(e) for e in schema_elements]
+        # Models are shared process-wide so one instance per database is cheap
+        self.registry = registry or get_registry()
 
         # Keyword extractor and TF-IDF are always used
+        from sklearn.feature_extraction.text import TfidfVectorizer
         self.keyword_extractor = yake.KeywordExtractor(lan='fr', top=15)
+        # LRU of extracted keywords keyed by the normalized question
+        self.keyword_cache: "OrderedDict[str, List[str]]" = OrderedDict()
+        self.keyword_cache_size = keyword_cache_size
+        self.keyword_hits = self.keyword_misses = 0
+        self.keyword_seconds = 0.0  # time spent extracting cache misses
         self.tfidf = TfidfVectorizer(ngram_range=(1, 3), stop_words=['french'])
+        # Document frequencies are kept up to date by add_to_memory and
+        # snapshotted next to the memory file
+        self.tfidf_path = os.path.splitext(self.memory_path)[0] + ".tfidf.json"
+        self.tfidf_index = TfidfIndex.load(self.tfidf_path, self.memory, self.tfidf.build_analyzer())
+        self._tfidf_saved = self.tfidf_index.loaded_docs
+        self._save_tfidf()
 
         # Initialize according to mode
         if self.mode in {'normal', 'advanced'}:
+            # torch is only loaded by the modes that need it
+            import torch
+
             # Dense embedding model
-            embedding_model = 'distiluse-base-multilingual-cased-v2'
-            self.embedder = SentenceTransformer(embedding_model)
-            self.schema_embeddings = self.embedder.encode(
-                self.schema_elements, convert_to_tensor=True
-            )
+            self.embedder = self.registry.get_embedder(embedding_model, device, embed_backend)
+            if embedding_cache_dir is None:
+                embeddings = self.embedder.encode(self.schema_elements, convert_to_tensor=True)
+            else:
+                # Quantized backends give slightly different vectors, so they get their own cache
+                cache_name = embedding_model if embed_backend == "torch" else f"{embedding_model}@{embed_backend}"
+                cache = EmbeddingCache(cache_name, embedding_cache_dir)
+                matrix = cache.get_or_encode(
+                    self.schema_elements,
+                    lambda elems: self.embedder.encode(elems, convert_to_numpy=True),
+                )
+                embeddings = torch.from_numpy(np.array(matrix)).to(self.embedder.device)
+            self.schema_embeddings, self.schema_scale = self._store_schema(embeddings, schema_dtype)
         if self.mode == 'advanced':
             # Cross-encoder model for reranking
-            cross_encoder_model = 'cross-encoder/quora-roberta-base'
-            self.cross_encoder = CrossEncoder(cross_encoder_model)
+            self.cross_encoder = self.registry.get_cross_encoder(cross_encoder_model, device)
+            self.rerank_top_k = rerank_top_k
+            # LRU memo of cross-encoder scores keyed by (phrase, schema element)
+            self.rerank_cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+            self.rerank_cache_size = rerank_cache_size
+
+    @staticmethod
+    def _store_schema(embeddings, dtype: str):
+        """Unit-normalize schema embeddings and store them as *dtype*.
+
+        ``int8`` keeps one float scale per row (symmetric quantization);
+        the scale is ``None`` for the float types.
+        """
+        import torch
+
+        unit = torch.nn.functional.normalize(embeddings.float(), dim=1)
+        if dtype == "float32":
+            return unit, None
+        if dtype == "float16":
+            return unit.half(), None
+        if dtype == "int8":
+            scale = unit.abs().amax(dim=1, keepdim=True).clamp(min=1e-12) / 127
+            return torch.round(unit / scale).to(torch.int8), scale
+        raise ValueError(f"Unknown schema dtype {dtype!r}, expected 'float32', 'float16' or 'int8'")
+
+    def schema_scores(self, phrase_embeds):
+        """Cosine similarity of every phrase embedding with every schema element."""
+        import torch
 
-    def _load_memory(self) -> List[str]:
-        if os.path.exists(self.memory_path):
-            with open(self.memory_path, "r", encoding="utf-8") as f:
-                return [line.strip() for line in f if line.strip()]
-        return []
+        phrases = torch.nn.functional.normalize(phrase_embeds.float(), dim=1)
+        scores = phrases @ self.schema_embeddings.to(phrases.device, phrases.dtype).T
+        if self.schema_scale is not None:
+            scores = scores * self.schema_scale.to(phrases.device).T
+        return scores
 
-    def _save_memory(self) -> None:
-        os.makedirs(os.path.dirname(self.memory_path), exist_ok=True)
-        with open(self.memory_path, "w", encoding="utf-8") as f:
-            for q in self.memory:
-                f.write(q + "\n")
+    def _save_tfidf(self, every: int = 1) -> None:
+        # Snapshots may lag behind: TfidfIndex.load catches up on missing lines
+        if self.tfidf_index.n_docs - self._tfidf_saved >= every:
+            self.tfidf_index.save(self.tfidf_path)
+            self._tfidf_saved = self.tfidf_index.n_docs
 
     def add_to_memory(self, question: str) -> None:
         q = question.strip()
-        if q.lower() not in {m.lower() for m in self.memory}:
-            self.memory.append(q)
-            self._save_memory()
+        if self.store.add(q):
+            self.tfidf_index.add(q)
+            self._save_tfidf(every=50)
+
+    def add_many_to_memory(self, questions: Iterable[str]) -> None:
+        added = self.store.extend(q.strip() for q in questions)
+        if added:
+            self.tfidf_index.extend(added)
+            self._save_tfidf(every=50)
+
+    @staticmethod
+    def _keyword_key(question: str) -> str:
+        return " ".join(question.lower().split())
+
+    def _cache_keywords(self, key: str, keywords: List[str]) -> None:
+        self.keyword_cache[key] = keywords
+        while len(self.keyword_cache) > self.keyword_cache_size:
+            self.keyword_cache.popitem(last=False)
+
+    def _cached_keywords(self, key: str) -> Optional[List[str]]:
+        keywords = self.keyword_cache.get(key)
+        if keywords is None:
+            self.keyword_misses += 1
+        else:
+            self.keyword_hits += 1
+            self.keyword_cache.move_to_end(key)
+        return keywords
 
     def extract_keywords(self, question: str) -> List[str]:
-        raw = self.keyword_extractor.extract_keywords(question)
-        return [phrase for phrase, _ in raw]
+        key = self._keyword_key(question)
+        keywords = self._cached_keywords(key)
+        if keywords is None:
+            start = time.perf_counter()
+            raw = self.keyword_extractor.extract_keywords(question)
+            keywords = [phrase for phrase, _ in raw]
+            self.keyword_seconds += time.perf_counter() - start
+            self._cache_keywords(key, keywords)
+        return list(keywords)
+
+    def extract_keywords_batch(self, questions: List[str], workers: Optional[int] = None) -> List[List[str]]:
+        """Keywords of every question; cache misses go to a process pool for large batches."""
+        keys = [self._keyword_key(q) for q in questions]
+        found = {key: self._cached_keywords(key) for key in dict.fromkeys(keys)}
+        missing = {key: q for key, q in zip(keys, questions) if found[key] is None}
+        if missing:
+            start = time.perf_counter()
+            texts = list(missing.values())
+            if workers == 1 or len(texts) < MIN_POOL_BATCH:
+                extracted = [[phrase for phrase, _ in self.keyword_extractor.extract_keywords(t)] for t in texts]
+            else:
+                workers = workers or os.cpu_count() or 1
+                pool = _keyword_pool(workers)
+                extracted = list(pool.map(_extract_keywords, texts, chunksize=max(1, len(texts) // (4 * workers))))
+            self.keyword_seconds += time.perf_counter() - start
+            for key, keywords in zip(missing, extracted):
+                found[key] = keywords
+                self._cache_keywords(key, keywords)
+        return [list(found[key]) for key in keys]
+
+    def keyword_stats(self) -> Dict[str, Any]:
+        lookups = self.keyword_hits + self.keyword_misses
+        return {
+            "hits": self.keyword_hits,
+            "misses": self.keyword_misses,
+            "hit_rate": self.keyword_hits / lookups if lookups else 0.0,
+            "entries": len(self.keyword_cache),
+            "extract_seconds": self.keyword_seconds,
+            "mean_extract_ms": 1000 * self.keyword_seconds / self.keyword_misses if self.keyword_misses else 0.0,
+        }
 
     def rank_by_tfidf(self, candidates: List[str], top_n: int = 8) -> List[str]:
         if self.memory == []:
             return candidates[:top_n]
-        self.tfidf.fit(self.memory)
-        analyzer = self.tfidf.build_analyzer()
-        idf = self.tfidf.idf_
-        vocab = self.tfidf.vocabulary_
+        index = self.tfidf_index
         scored = []
         for phrase in candidates:
-            tokens = analyzer(phrase)
-            vals = [idf[vocab[t]] for t in tokens if t in vocab]
+            tokens = index.analyzer(phrase)
+            vals = [index.idf(t) for t in tokens if t in index]
             avg_idf = sum(vals) / len(vals) if vals else 0.0
             scored.append((phrase, avg_idf))
         scored.sort(key=lambda x: x[1], reverse=True)
         return [phrase for phrase, _ in scored[:top_n]]
 
-    def fuzzy_match_schema(self, keywords: List[str], cutoff: int = 70) -> List[dict]:
-        matches = []
-        for kw in keywords:
-            result = process.extractOne(
-                kw, self.schema_elements,
-                scorer=fuzz.WRatio,
-                score_cutoff=cutoff
-            )
-            if result:
-                elem, score, _ = result
-                matches.append({
-                    'keyword': kw,
-                    'schema_element': elem,
-                    'score': score
-                })
-        return matches
+    def fuzzy_match_schema(self, keywords: List[str], cutoff: int = 70, top_k: int = 1) -> List[dict]:
+        return self.fuzzy_match_batch([keywords], cutoff, top_k)[0]
+
+    def fuzzy_match_batch(self, keyword_lists: List[List[str]], cutoff: int = 70, top_k: int = 1) -> List[List[dict]]:
+        """Best ``top_k`` schema elements per keyword from one keyword x schema score matrix.
+
+        ``process.cdist`` scores every pair on all cores; scores under
+        ``cutoff`` are dropped. With ``top_k=1`` ties go to the first schema
+        element, as with ``process.extractOne``.
+        """
+        flat = [default_process(kw) for keywords in keyword_lists for kw in keywords]
+        if not flat or not self.schema_elements:
+            return [[] for _ in keyword_lists]
+        scores = process.cdist(
+            flat, self.fuzzy_choices, scorer=fuzz.WRatio, score_cutoff=cutoff, workers=-1
+        )
+        top_k = min(top_k, scores.shape[1])
+        if top_k == 1:
+            best = scores.argmax(axis=1)[:, None]
+        else:
+            best = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+            # argpartition leaves the top k unordered; sort them by score then schema order
+            order = np.lexsort((best, -np.take_along_axis(scores, best, axis=1)), axis=1)
+            best = np.take_along_axis(best, order, axis=1)
+
+        results, row = [], 0
+        for keywords in keyword_lists:
+            matches = []
+            for kw in keywords:
+                for idx in best[row]:
+                    score = float(scores[row, idx])
+                    if score >= cutoff and score > 0:
+                        matches.append({
+                            'keyword': kw,
+                            'schema_element': self.schema_elements[idx],
+                            'score': score
+                        })
+                row += 1
+            results.append(matches)
+        return results
 
     def semantic_match(self, phrases: List[str], top_k: int = 3, min_score: float = 0.5) -> List[dict]:
         results = []
         phrase_embeds = self.embedder.encode(phrases, convert_to_tensor=True)
-        cos_scores = util.cos_sim(phrase_embeds, self.schema_embeddings)
+        cos_scores = self.schema_scores(phrase_embeds)
         for i, phrase in enumerate(phrases):
             top_indices = cos_scores[i].topk(k=top_k).indices
             for idx in top_indices:
@@ -108,19 +305,82 @@ class DialogModule:
                     })
         return results
 
+    def semantic_match_batch(
+        self, phrase_lists: List[List[str]], top_k: int = 3, min_score: float = 0.5
+    ) -> List[List[dict]]:
+        """:meth:`semantic_match` for many phrase lists with one encode call and one matrix product."""
+        flat = [phrase for phrases in phrase_lists for phrase in phrases]
+        if not flat:
+            return [[] for _ in phrase_lists]
+        phrase_embeds = self.embedder.encode(flat, convert_to_tensor=True)
+        cos_scores = self.schema_scores(phrase_embeds)
+        values, indices = cos_scores.topk(k=min(top_k, cos_scores.shape[1]), dim=1)
+        values, indices = values.tolist(), indices.tolist()
+
+        results, row = [], 0
+        for phrases in phrase_lists:
+            hits = []
+            for phrase in phrases:
+                for score, idx in zip(values[row], indices[row]):
+                    if score >= min_score:
+                        hits.append({
+                            'keyword': phrase,
+                            'schema_element': self.schema_elements[idx],
+                            'score': score * 100
+                        })
+                row += 1
+            results.append(hits)
+        return results
+
+    def _cross_scores(self, pairs: List[Tuple[str, str]]) -> Dict[Tuple[str, str], float]:
+        """Cross-encoder scores of *pairs*, predicting the unseen ones in one call."""
+        scores = {}
+        for pair in pairs:
+            if pair in self.rerank_cache:
+                self.rerank_cache.move_to_end(pair)
+                scores[pair] = self.rerank_cache[pair]
+        missing = [pair for pair in dict.fromkeys(pairs) if pair not in scores]
+        if missing:
+            for pair, score in zip(missing, self.cross_encoder.predict(missing)):
+                scores[pair] = self.rerank_cache[pair] = float(score)
+            while len(self.rerank_cache) > self.rerank_cache_size:
+                self.rerank_cache.popitem(last=False)
+        return scores
+
+    def _rerank_groups(self, phrases: List[str], hits: List[dict]) -> List[Tuple[str, List[str]]]:
+        # Candidates in first-seen order, so reranking is deterministic
+        if self.rerank_top_k is None:
+            candidates = list(dict.fromkeys(hit['schema_element'] for hit in hits))
+            return [(phrase, candidates) for phrase in phrases]
+        per_phrase: Dict[str, List[str]] = {}
+        for hit in hits:  # semantic hits come best first for each phrase
+            per_phrase.setdefault(hit['keyword'], []).append(hit['schema_element'])
+        return [(phrase, per_phrase.get(phrase, [])[:self.rerank_top_k]) for phrase in phrases]
+
     def cross_rerank(self, phrases: List[str], candidates: List[str], top_k: int = 3) -> List[dict]:
-        reranked = []
-        for phrase in phrases:
-            inputs = [(phrase, cand) for cand in candidates]
-            scores = self.cross_encoder.predict(inputs)
-            top = sorted(zip(candidates, scores), key=lambda x: x[1], reverse=True)[:top_k]
-            for elem, score in top:
-                reranked.append({
-                    'keyword': phrase,
-                    'schema_element': elem,
-                    'score': score * 100
-                })
-        return reranked
+        return self.cross_rerank_batch([[(phrase, candidates) for phrase in phrases]], top_k)[0]
+
+    def cross_rerank_batch(
+        self, groups: List[List[Tuple[str, List[str]]]], top_k: int = 3
+    ) -> List[List[dict]]:
+        """Rerank each group's (phrase, candidates) with one ``predict`` call for all of them."""
+        scores = self._cross_scores(
+            [(phrase, cand) for group in groups for phrase, cands in group for cand in cands]
+        )
+        results = []
+        for group in groups:
+            reranked = []
+            for phrase, cands in group:
+                # sorted is stable: ties keep the candidate order
+                top = sorted(cands, key=lambda c: scores[(phrase, c)], reverse=True)[:top_k]
+                for elem in top:
+                    reranked.append({
+                        'keyword': phrase,
+                        'schema_element': elem,
+                        'score': scores[(phrase, elem)] * 100
+                    })
+            results.append(reranked)
+        return results
 
     def schema_link(self, question: str) -> List[dict]:
         self.add_to_memory(question)
@@ -131,11 +391,28 @@ class DialogModule:
         if self.mode in {'normal', 'advanced'}:
             semantic_hits = self.semantic_match(top_phrases, top_k=10, min_score=0.0)
             if self.mode == 'normal': return semantic_hits # normal mode
-            candidates = list({hit['schema_element'] for hit in semantic_hits})
-            return self.cross_rerank(top_phrases, candidates) # advanced mode
+            return self.cross_rerank_batch([self._rerank_groups(top_phrases, semantic_hits)])[0] # advanced mode
 
         return self.fuzzy_match_schema(top_phrases) # light mode
 
+    def schema_link_batch(self, questions: List[str], workers: Optional[int] = None) -> List[List[dict]]:
+        """Link many questions at once, returning what :meth:`schema_link` returns for each.
+
+        The whole batch is added to memory first, so TF-IDF weights already
+        count every question of the batch.
+        """
+        self.add_many_to_memory(questions)
+        top_phrases = [self.rank_by_tfidf(kws) for kws in self.extract_keywords_batch(questions, workers)]
+
+        if self.mode in {'normal', 'advanced'}:
+            semantic_hits = self.semantic_match_batch(top_phrases, top_k=10, min_score=0.0)
+            if self.mode == 'normal': return semantic_hits
+            return self.cross_rerank_batch(
+                [self._rerank_groups(phrases, hits) for phrases, hits in zip(top_phrases, semantic_hits)]
+            )
+
+        return self.fuzzy_match_batch(top_phrases)
+
     def ask(self, prefix: str = "Question: ", prompt: str | None = None) -> str:
         """Prompt the user and return the entered text."""
         if prompt is not None:
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """Persist embedding matrices as memory-mapped ``.npy`` files.
+
+    Files live under ``cache_dir/<model_name>``:
+      * ``<key>.npy`` – the matrix for one element list, where ``key`` hashes
+        the model name and the ordered elements. A warm start only maps it.
+      * ``elements.npy`` / ``elements.json`` – one vector per distinct element
+        seen so far, so a changed list only re-encodes its new elements.
+    """
+
+    def __init__(self, model_name: str, cache_dir: str = "cache/embeddings"):
+        self.model_name = model_name
+        self.cache_dir = os.path.join(cache_dir, model_name.replace("/", "__"))
+        self._index: Optional[Dict[str, int]] = None
+        self._vectors: Optional[np.ndarray] = None
+
+    def key(self, elements: List[str]) -> str:
+        digest = hashlib.sha1(self.model_name.encode("utf-8"))
+        for element in elements:
+            digest.update(b"\0" + element.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get_or_encode(
+        self, elements: List[str], encode: Callable[[List[str]], np.ndarray]
+    ) -> np.ndarray:
+        """Return the embedding matrix of *elements*, encoding only unseen ones."""
+        path = os.path.join(self.cache_dir, f"{self.key(elements)}.npy")
+        if os.path.exists(path):
+            return np.load(path, mmap_mode="r")
+
+        index, vectors = self._load_elements()
+        missing = [e for e in dict.fromkeys(elements) if e not in index]
+        if missing:
+            new = np.asarray(encode(missing), dtype=np.float32)
+            vectors = new if vectors is None else np.concatenate([vectors, new])
+            for element in missing:
+                index[element] = len(index)
+            self._save_elements(index, vectors)
+
+        self._write(path, vectors[[index[e] for e in elements]])
+        return np.load(path, mmap_mode="r")
+
+    def _load_elements(self) -> Tuple[Dict[str, int], Optional[np.ndarray]]:
+        if self._index is None:
+            index_path = os.path.join(self.cache_dir, "elements.json")
+            vectors_path = os.path.join(self.cache_dir, "elements.npy")
+            if os.path.exists(index_path) and os.path.exists(vectors_path):
+                with open(index_path, "r", encoding="utf-8") as f:
+                    self._index = json.load(f)
+                self._vectors = np.load(vectors_path)
+            else:
+                self._index, self._vectors = {}, None
+        return self._index, self._vectors
+
+    def _save_elements(self, index: Dict[str, int], vectors: np.ndarray) -> None:
+        self._write(os.path.join(self.cache_dir, "elements.npy"), vectors)
+        tmp = os.path.join(self.cache_dir, "elements.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(self.cache_dir, "elements.json"))
+        self._index, self._vectors = index, vectors
+
+    def _write(self, path: str, array: np.ndarray) -> None:
+        # Write then rename so a concurrent reader never maps a partial file.
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp, path)
@@ -0,0 +1,73 @@
+import os
+from typing import Iterable, Iterator, List
+
+
+class MemoryStore:
+    """Append-only file of past questions with a case-insensitive index.
+
+    Lines are kept in file order with duplicates (ignoring case) dropped on
+    load. New questions are appended and fsynced without rewriting the file;
+    ``compact`` rewrites it once to drop duplicates left by older runs.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lines: List[str] = []
+        self._keys = set()
+        self._needs_newline = False
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                content = f.read()
+            self._needs_newline = bool(content) and not content.endswith("\n")
+            for line in content.splitlines():
+                self._index(line.strip())
+
+    def _index(self, question: str) -> bool:
+        key = question.lower()
+        if not question or key in self._keys:
+            return False
+        self._keys.add(key)
+        self.lines.append(question)
+        return True
+
+    def __contains__(self, question: str) -> bool:
+        return question.strip().lower() in self._keys
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.lines)
+
+    def add(self, question: str) -> bool:
+        """Append *question* unless already stored; return whether it was added."""
+        return bool(self.extend([question]))
+
+    def extend(self, questions: Iterable[str]) -> List[str]:
+        """Append every new question in one write and return those added."""
+        added = [q for q in (q.strip() for q in questions) if self._index(q)]
+        if added:
+            self._append(added)
+        return added
+
+    def _append(self, questions: List[str]) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            if self._needs_newline:
+                f.write("\n")
+                self._needs_newline = False
+            f.writelines(q + "\n" for q in questions)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def compact(self) -> None:
+        """Rewrite the file with exactly the indexed lines."""
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(q + "\n" for q in self.lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._needs_newline = False
@@ -0,0 +1,126 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Callable, Optional, Tuple
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer, CrossEncoder
+
+
+# Embedder runtimes selectable with ``backend``:
+#   torch      - the model as published (default)
+#   torch-int8 - Linear layers dynamically quantized to int8, CPU only
+#   onnx       - exported to ONNX and run by onnxruntime
+#   onnx-int8  - the ONNX export dynamically quantized to int8
+# The onnx backends need the optional sentence-transformers[onnx] extra.
+EMBED_BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+# Quantization target of the onnx-int8 backend ("arm64", "avx2", "avx512", "avx512_vnni")
+ONNX_QUANTIZATION = "avx2"
+
+
+def _load_embedder(
+    model_name: str, device: Optional[str], backend: str = "torch", onnx_dir: str = "cache/onnx"
+) -> "SentenceTransformer":
+    # Imported here so the registry can be created without loading torch
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "torch":
+        return SentenceTransformer(model_name, device=device)
+    if backend == "torch-int8":
+        import torch
+
+        model = SentenceTransformer(model_name, device="cpu")
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if backend == "onnx":
+        return SentenceTransformer(model_name, device="cpu", backend="onnx")
+    if backend == "onnx-int8":
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+
+        # The quantized export is written once next to a local copy of the model
+        path = os.path.join(onnx_dir, model_name.replace("/", "__"))
+        file_name = f"onnx/model_qint8_{ONNX_QUANTIZATION}.onnx"
+        if not os.path.exists(os.path.join(path, file_name)):
+            model = SentenceTransformer(model_name, device="cpu", backend="onnx")
+            model.save(path)
+            export_dynamic_quantized_onnx_model(model, ONNX_QUANTIZATION, path)
+        return SentenceTransformer(path, device="cpu", backend="onnx", model_kwargs={"file_name": file_name})
+    raise ValueError(f"Unknown embedder backend {backend!r}, expected one of {EMBED_BACKENDS}")
+
+
+def _load_cross_encoder(model_name: str, device: Optional[str]) -> "CrossEncoder":
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(model_name, device=device)
+
+
+class ModelRegistry:
+    """Process-wide cache of embedding and cross-encoder models.
+
+    Models are loaded lazily on first request and shared by every caller
+    asking for the same ``(kind, model_name, device)``. When ``max_size`` is
+    set, the least recently used model is dropped once the limit is exceeded.
+    """
+
+    def __init__(self, max_size: Optional[int] = None):
+        self.max_size = max_size
+        self._models: "OrderedDict[Tuple[str, str, str], Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        kind: str,
+        model_name: str,
+        device: Optional[str],
+        loader: Callable[[str, Optional[str]], Any],
+    ) -> Any:
+        """Return the cached model for the key, loading it with *loader* if needed."""
+        key = (kind, model_name, device or "auto")
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+            # Loading under the lock keeps concurrent callers from loading twice.
+            model = loader(model_name, device)
+            self._models[key] = model
+            if self.max_size is not None:
+                while len(self._models) > self.max_size:
+                    self._models.popitem(last=False)
+            return model
+
+    def get_embedder(
+        self, model_name: str, device: Optional[str] = None, backend: str = "torch"
+    ) -> "SentenceTransformer":
+        kind = "embedder" if backend == "torch" else f"embedder:{backend}"
+        return self.get(kind, model_name, device, lambda n, d: _load_embedder(n, d, backend))
+
+    def get_cross_encoder(self, model_name: str, device: Optional[str] = None) -> "CrossEncoder":
+        return self.get("cross_encoder", model_name, device, _load_cross_encoder)
+
+    def evict(self, kind: str, model_name: str, device: Optional[str] = None) -> None:
+        with self._lock:
+            self._models.pop((kind, model_name, device or "auto"), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._models.clear()
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+
+_registry = ModelRegistry()
+
+
+def get_registry() -> ModelRegistry:
+    """Return the registry shared by the whole process."""
+    return _registry
+
+
+def get_embedder(
+    model_name: str, device: Optional[str] = None, backend: str = "torch"
+) -> "SentenceTransformer":
+    return _registry.get_embedder(model_name, device, backend)
+
+
+def get_cross_encoder(model_name: str, device: Optional[str] = None) -> "CrossEncoder":
+    return _registry.get_cross_encoder(model_name, device)
@@ -0,0 +1,145 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+_tokenize = False  # not looked up yet
+
+
+def _tokenizer():
+    # The Spider tools pull in nltk, so they are only imported on first use
+    global _tokenize
+    if _tokenize is False:
+        try:
+            from spider.process_sql import tokenize as _tokenize
+        except ImportError:  # the Spider tools are only required for evaluation
+            _tokenize = None
+    return _tokenize
+
+
+def normalize_sql(sql: str, keep_quotes: bool = True) -> str:
+    """Join the Spider tokens of *sql*: keywords and names lowercased, spacing unified.
+
+    The Spider tokenizer rewrites ``'`` to ``"``, which would give a string
+    literal and a ``"column"`` reference the same result cache key, so by
+    default each quoted token gets its original quote character back.
+    ``evaluation`` compares queries with ``keep_quotes=False``, as Spider
+    does. Falls back to collapsing whitespace when the tokenizer is missing
+    or rejects the statement (e.g. unbalanced quotes).
+    """
+    sql = sql.strip().rstrip(";")
+    tokenize = _tokenizer()
+    if tokenize is not None:
+        try:
+            tokens = tokenize(sql)
+        except Exception:
+            tokens = None
+        if tokens is not None and keep_quotes:
+            tokens = _restore_quotes(sql, tokens)
+        if tokens is not None:
+            return " ".join(tokens)
+    return " ".join(sql.split())
+
+
+def _restore_quotes(sql: str, tokens: List[str]) -> Optional[List[str]]:
+    """Put the original quote characters back into Spider's quoted tokens."""
+    # Spider pairs the quotes in order, whichever character they are
+    quotes = [i for i, ch in enumerate(sql) if ch in "'\""]
+    spans = [sql[start:end + 1] for start, end in zip(quotes[::2], quotes[1::2])]
+    quoted = [i for i, tok in enumerate(tokens) if tok.startswith('"')]
+    if len(quoted) != len(spans):
+        return None
+    tokens = list(tokens)
+    for i, span in zip(quoted, spans):
+        if tokens[i] != span.replace("'", '"'):
+            return None
+        tokens[i] = span
+    return tokens
+
+
+def estimate_size(result: Dict[str, Any]) -> int:
+    """Rough number of bytes held by a query result."""
+    size = sys.getsizeof(result)
+    for row in result.get("rows", ()):
+        size += sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row)
+    return size
+
+
+class ResultCache:
+    """LRU cache of query results bounded by their estimated size in bytes.
+
+    Entries are keyed by the normalized SQL plus parameters and paging, and
+    tagged with a data token (``PRAGMA data_version`` and file mtime). A
+    different token on lookup means the data changed, so the cache is cleared.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries: "OrderedDict[Hashable, Tuple[Dict[str, Any], int]]" = OrderedDict()
+        self._token: Optional[Hashable] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(query: str, params: Any = (), limit: Optional[int] = None, offset: int = 0) -> Hashable:
+        return (normalize_sql(query), repr(params), limit, offset)
+
+    def validate(self, token: Hashable) -> None:
+        """Clear the cache if the database changed since the last call."""
+        with self._lock:
+            if token != self._token:
+                if self._token is not None:
+                    self._clear()
+                self._token = token
+
+    def get(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            result = entry[0]
+        # Callers may mutate what they get back
+        return {**result, "rows": list(result["rows"])}
+
+    def put(self, key: Hashable, result: Dict[str, Any]) -> None:
+        size = estimate_size(result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            self._entries[key] = ({**result, "rows": list(result["rows"])}, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear()
+
+    def _clear(self) -> None:
+        if self._entries:
+            self.invalidations += 1
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "entries": len(self._entries),
+            "bytes": self.size,
+        }
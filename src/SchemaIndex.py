@@ -0,0 +1,112 @@
+import json
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from DBManager import DBManager
+from EmbeddingCache import EmbeddingCache
+from ModelRegistry import ModelRegistry, get_registry
+
+
+def flatten_schema(schema_pairs: Dict[str, List[str]]) -> List[str]:
+    """Table names followed by ``"column table"`` pairs, the elements DialogModule links to."""
+    return list(schema_pairs.keys()) + [
+        f"{col} {table}" for table, cols in schema_pairs.items() for col in cols
+    ]
+
+
+def load_schemas(db_root: str) -> Dict[str, Dict[str, List[str]]]:
+    """Introspect every ``<db_root>/<db_id>/<db_id>.sqlite`` database."""
+    schemas = {}
+    for db_id in sorted(os.listdir(db_root)):
+        db_path = os.path.join(db_root, db_id, f"{db_id}.sqlite")
+        if os.path.exists(db_path):
+            db = DBManager(db_path, immutable=True)
+            try:
+                schemas[db_id] = db.extract_column_table_pairs()
+            finally:
+                db.close()
+    return schemas
+
+
+def load_tables_json(path: str) -> Dict[str, Dict[str, List[str]]]:
+    """Read the schemas of a Spider ``tables.json`` file without opening any database."""
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    schemas = {}
+    for entry in entries:
+        tables = entry["table_names_original"]
+        schema: Dict[str, List[str]] = {t: [] for t in tables}
+        for table_idx, column in entry["column_names_original"]:
+            if table_idx >= 0:  # index -1 is the ``*`` column
+                schema[tables[table_idx]].append(column)
+        schemas[entry["db_id"]] = schema
+    return schemas
+
+
+class SchemaIndex:
+    """Catalog-wide vector index routing a question to the databases likely to answer it.
+
+    Every schema element of every database is embedded once (through the
+    :class:`EmbeddingCache`, which DialogModule shares) into one normalized
+    matrix. A question is scored against all elements with a single matrix
+    product, and each database gets the mean of its ``top_m`` best
+    similarities, so a few strongly matching tables beat many weak ones.
+    """
+
+    def __init__(
+        self,
+        schemas: Dict[str, Dict[str, List[str]]],
+        embedding_model: str = 'distiluse-base-multilingual-cased-v2',
+        device: Optional[str] = None,
+        registry: Optional[ModelRegistry] = None,
+        embedding_cache_dir: Optional[str] = "cache/embeddings",  # None disables the cache
+    ):
+        self.schemas = {db_id: schema for db_id, schema in schemas.items() if schema}
+        self.db_ids = list(self.schemas)
+        self.embedder = (registry or get_registry()).get_embedder(embedding_model, device)
+
+        elements: List[str] = []
+        offsets = [0]
+        for db_id in self.db_ids:
+            elements += flatten_schema(self.schemas[db_id])
+            offsets.append(len(elements))
+        self.offsets = np.array(offsets)
+
+        if embedding_cache_dir is None:
+            matrix = self._encode(elements)
+        else:
+            matrix = EmbeddingCache(embedding_model, embedding_cache_dir).get_or_encode(elements, self._encode)
+        self.vectors = self._normalize(np.asarray(matrix, dtype=np.float32))
+
+    @classmethod
+    def from_directory(cls, db_root: str = "databases/spider/test_database", **kwargs) -> "SchemaIndex":
+        return cls(load_schemas(db_root), **kwargs)
+
+    @classmethod
+    def from_tables_json(cls, path: str, **kwargs) -> "SchemaIndex":
+        return cls(load_tables_json(path), **kwargs)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        return self.embedder.encode(texts, convert_to_numpy=True)
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        return matrix / np.maximum(np.linalg.norm(matrix, axis=-1, keepdims=True), 1e-12)
+
+    def schema_elements(self, db_id: str) -> List[str]:
+        """Schema elements of *db_id*, ready to build its DialogModule."""
+        return flatten_schema(self.schemas[db_id])
+
+    def route(self, question: str, k: int = 3, top_m: int = 3) -> List[dict]:
+        """Return the *k* most likely databases for *question*, best first."""
+        query = self._normalize(np.asarray(self._encode([question])[0], dtype=np.float32))
+        sims = self.vectors @ query
+        scores = np.empty(len(self.db_ids), dtype=np.float32)
+        for i in range(len(self.db_ids)):
+            segment = sims[self.offsets[i]:self.offsets[i + 1]]
+            m = min(top_m, len(segment))
+            scores[i] = np.partition(segment, len(segment) - m)[-m:].mean()
+        best = np.argsort(-scores)[:k]
+        return [{'db_id': self.db_ids[i], 'score': float(scores[i])} for i in best]
@@ -0,0 +1,114 @@
+import atexit
+import json
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+import torch
+from sentence_transformers import util
+
+IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+class SemanticCache:
+    """Reuse accepted SQL for paraphrases of questions already answered.
+
+    Entries hold a question, its embedding (from the ``DialogModule``
+    embedder), the SQL accepted for it and the schema names that SQL
+    references. A lookup returns the entry whose question is most similar
+    above ``threshold``. Entries naming a table or column missing from the
+    current schema are dropped on load, and the least recently used entry
+    is evicted past ``max_entries``. The cache is persisted as JSON per
+    database: on every ``add``, and for hits (which only move the LRU
+    clock) on ``close()`` or interpreter exit.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        embedder: Any,
+        schema_elements: Iterable[str],
+        threshold: float = 0.92,
+        max_entries: int = 1000,
+    ):
+        self.path = path
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        # Schema elements are "table" or "column table"
+        self.schema_names = {name.lower() for elem in schema_elements for name in elem.split(" ")}
+        self.entries: List[Dict[str, Any]] = []
+        self._matrix: Optional[torch.Tensor] = None
+        self._clock = 0
+        self._dirty = False  # hits not written yet
+        self._load()
+        atexit.register(self.close)
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        self.entries = [e for e in entries if set(e["names"]) <= self.schema_names]
+        self._clock = max((e["used"] for e in self.entries), default=0)
+        if len(self.entries) != len(entries):
+            self._save()
+
+    def _save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+        self._dirty = False
+
+    def _embeddings(self) -> torch.Tensor:
+        if self._matrix is None:
+            self._matrix = torch.tensor([e["embedding"] for e in self.entries])
+        return self._matrix
+
+    def _encode(self, question: str) -> torch.Tensor:
+        return self.embedder.encode(question, convert_to_tensor=True).cpu()
+
+    def lookup(self, question: str) -> Optional[Dict[str, Any]]:
+        """Return ``{"question", "sql", "score"}`` for the closest cached question, or None."""
+        if not self.entries:
+            return None
+        key = question.strip().lower()
+        best = next((i for i, e in enumerate(self.entries) if e["question"].lower() == key), None)
+        score = 1.0
+        if best is None:
+            scores = util.cos_sim(self._encode(question), self._embeddings())[0]
+            best = int(scores.argmax())
+            score = float(scores[best])
+            if score < self.threshold:
+                return None
+        entry = self.entries[best]
+        self._clock += 1
+        entry["used"] = self._clock
+        self._dirty = True
+        return {"question": entry["question"], "sql": entry["sql"], "score": score}
+
+    def add(self, question: str, sql: str) -> None:
+        """Record *sql* as the accepted answer to *question* and persist the cache."""
+        question = question.strip()
+        names = sorted({t.lower() for t in IDENTIFIER.findall(sql)} & self.schema_names)
+        self.entries = [e for e in self.entries if e["question"].lower() != question.lower()]
+        self._clock += 1
+        self.entries.append({
+            "question": question,
+            "sql": sql,
+            "names": names,
+            "embedding": self._encode(question).tolist(),
+            "used": self._clock,
+        })
+        if len(self.entries) > self.max_entries:
+            self.entries.sort(key=lambda e: e["used"])
+            del self.entries[: len(self.entries) - self.max_entries]
+        self._matrix = None
+        self._save()
+
+    def close(self) -> None:
+        """Write the recency of hits since the last ``add`` to disk."""
+        if self._dirty:
+            self._save()
@@ -0,0 +1,74 @@
+import hashlib
+import json
+import math
+import os
+from typing import Callable, Dict, Iterable, List
+
+
+class TfidfIndex:
+    """Incrementally maintained document frequencies for the dialog memory.
+
+    Computes the same smoothed IDF as ``TfidfVectorizer`` fitted on the
+    memory, ``ln((1 + n) / (1 + df)) + 1``, but each new document only
+    touches its own terms. Snapshots record how many memory lines they cover
+    and a running hash of those lines, so a reload only indexes the lines
+    appended since the snapshot and rebuilds if the prefix changed.
+    """
+
+    def __init__(self, analyzer: Callable[[str], List[str]]):
+        self.analyzer = analyzer
+        self.n_docs = 0
+        self.loaded_docs = 0  # documents covered by the snapshot this index was loaded from
+        self.df: Dict[str, int] = {}
+        self._digest = hashlib.sha1()
+
+    def add(self, document: str) -> None:
+        for term in set(self.analyzer(document)):
+            self.df[term] = self.df.get(term, 0) + 1
+        self.n_docs += 1
+        self._digest.update(document.encode("utf-8") + b"\n")
+
+    def extend(self, documents: Iterable[str]) -> None:
+        for document in documents:
+            self.add(document)
+
+    def idf(self, term: str) -> float:
+        return math.log((1 + self.n_docs) / (1 + self.df[term])) + 1.0
+
+    def __contains__(self, term: str) -> bool:
+        return term in self.df
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                {"n_docs": self.n_docs, "digest": self._digest.hexdigest(), "df": self.df},
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, documents: List[str], analyzer: Callable[[str], List[str]]) -> "TfidfIndex":
+        """Restore the snapshot at *path* and index documents it does not cover.
+
+        Falls back to a full rebuild when the snapshot is missing, unreadable
+        or was taken over a different memory prefix.
+        """
+        index = cls(analyzer)
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    snapshot = json.load(f)
+                n_docs = snapshot["n_docs"]
+                digest = hashlib.sha1()
+                for document in documents[:n_docs]:
+                    digest.update(document.encode("utf-8") + b"\n")
+                if n_docs <= len(documents) and digest.hexdigest() == snapshot["digest"]:
+                    index.n_docs, index.df, index._digest = n_docs, snapshot["df"], digest
+                    index.loaded_docs = n_docs
+            except (OSError, ValueError, KeyError):
+                pass
+        index.extend(documents[index.n_docs:])
+        return index
@@ -1,21 +1,51 @@
 """Convenience imports for the FR2SQL package.
 
 This module exposes the most commonly used classes and utilities so they
-can be imported directly from :mod:`src`.
+can be imported directly from :mod:`src`. They are resolved on first
+access, so ``import src`` does not pull in torch or the model libraries.
 """
 
-from .DBManager import DBManager
-from .DialogModule import DialogModule
-from utils import populate_dialog_memory
+import importlib
+import os
+import sys
 
-import agent
-import evaluation
+# Public name -> (module, attribute); a ``None`` attribute exposes the module.
+# The modules import each other as top-level modules (``from ResultCache
+# import ...``), so they are imported the same way, with this directory on
+# sys.path, rather than as ``src.X`` copies.
+_LAZY = {
+    "DBManager": ("DBManager", "DBManager"),
+    "DialogModule": ("DialogModule", "DialogModule"),
+    "ModelRegistry": ("ModelRegistry", "ModelRegistry"),
+    "get_registry": ("ModelRegistry", "get_registry"),
+    "populate_dialog_memory": ("utils", "populate_dialog_memory"),
+    "agent": ("agent", None),
+    "evaluation": ("evaluation", None),
+}
 
 __all__ = [
     "DBManager",
     "DialogModule",
+    "ModelRegistry",
+    "get_registry",
     "agent",
     "evaluation",
     "populate_dialog_memory",
 ]
 
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module_name, attr = _LAZY[name]
+    here = os.path.dirname(os.path.abspath(__file__))
+    if here not in sys.path:
+        sys.path.insert(0, here)
+    module = importlib.import_module(module_name)
+    value = module if attr is None else getattr(module, attr)
+    globals()[name] = value  # later lookups skip __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
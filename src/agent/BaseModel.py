@@ -1,7 +1,12 @@
 from __future__ import annotations
-from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+from transformers import AutoModelForSeq2SeqLM, AutoTokenizer, LogitsProcessorList
 import torch
 from agent import generate_sql_prompt
+from agent.PrefixCache import PrefixCache
+from agent.PromptGenerator import SQL_PROMPT_PREFIX
+from agent.SQLConstraint import SQLConstrainedLogitsProcessor, SQLPrefixValidator
+
+MAX_NEW_TOKENS = 150
 
 class BaseModel:
     """Lightweight NL2SQL agent using an off-the-shelf model.
@@ -14,20 +19,79 @@ class BaseModel:
 
     def __init__(self, model_name: str, device: str | None = None) -> None:
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        # Prompts end with the request, so overlong ones lose the preamble instead
+        self.tokenizer.truncation_side = "left"
         self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.prefix_cache: PrefixCache | None = None
+
+    def enable_prefix_cache(self, prefix: str = SQL_PROMPT_PREFIX) -> None:
+        """Precompute the key/value cache of *prefix*.
+
+        Only decoder-only agents (``LLaMA2``) support it; ``FlanT5`` is an
+        encoder-decoder model and raises ``ValueError``.
+        """
+        assert hasattr(self, 'model'), "Model must be loaded before caching the prompt prefix."
+        self.prefix_cache = PrefixCache(self.model, self.tokenizer, prefix)
+
+    @property
+    def prompt_reserve(self) -> int:
+        """Prompt tokens to leave free for the generated SQL.
 
-    def generate(self, prompt: str) -> str:
+        Decoder-only models append their output to the prompt in the same
+        context; encoder-decoder models do not.
+        """
+        if not hasattr(self, 'model') or self.model.config.is_encoder_decoder:
+            return 0
+        return MAX_NEW_TOKENS
+
+    def generate(self, prompt: str, validator: SQLPrefixValidator | None = None) -> str:
         """Generate a SQL query for *question* given the database *schema*."""
+        return self.generate_batch([prompt], [validator] if validator else None)[0]
+
+    def generate_batch(
+        self, prompts: list[str], validators: list[SQLPrefixValidator] | None = None
+    ) -> list[str]:
+        """Generate one SQL query per prompt with a single padded ``generate`` call.
+
+        With ``validators`` (one per prompt) decoding is constrained to SQL
+        that stays valid for each prompt's database.
+        """
         assert hasattr(self, 'model'), "Model must be loaded before generating SQL queries."
+        constraint = {}
+        if validators:
+            constraint["logits_processor"] = LogitsProcessorList(
+                [SQLConstrainedLogitsProcessor(self.tokenizer, validators)]
+            )
+        cache = self.prefix_cache
+        if cache is not None and cache.covers(prompts):
+            return cache.generate(
+                prompts,
+                max_new_tokens=MAX_NEW_TOKENS,
+                do_sample=False,
+                **constraint,
+            )
+        decoder_only = not self.model.config.is_encoder_decoder
+        if decoder_only:
+            # Decoder-only models continue from the last position, so pad on the left
+            if self.tokenizer.pad_token is None:
+                self.tokenizer.pad_token = self.tokenizer.eos_token
+            self.tokenizer.padding_side = "left"
         inputs = self.tokenizer(
-            prompt,
+            prompts,
             return_tensors="pt",
+            padding=True,
             truncation=True,
             max_length=self.tokenizer.model_max_length,
         ).to(self.device)
         outputs = self.model.generate(
             **inputs,
-            max_new_tokens=150,
+            max_new_tokens=MAX_NEW_TOKENS,
             do_sample=False,
+            pad_token_id=self.tokenizer.pad_token_id,
+            **constraint,
         )
-        return self.tokenizer.decode(outputs[0], skip_special_tokens=True).strip()
+        if decoder_only:
+            # Their rows start with the prompt: keep only the completion
+            outputs = outputs[:, inputs.input_ids.shape[1]:]
+        return [self.tokenizer.decode(out, skip_special_tokens=True).strip() for out in outputs]
+
@@ -1,5 +1,5 @@
 from __future__ import annotations
-from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+from transformers import AutoModelForCausalLM, AutoTokenizer
 from transformers.utils.quantization_config import BitsAndBytesConfig
 from agent.BaseModel import BaseModel
 
@@ -7,10 +7,11 @@ class LLaMA2(BaseModel):
     def __init__(self, device: str | None = None) -> None:
         model_name: str = "meta-llama/Llama-2-7b-chat-hf"
         super().__init__(model_name, device)
-        self.model = AutoModelForSeq2SeqLM.from_pretrained(
+        # LLaMA 2 is decoder-only, so it can use enable_prefix_cache()
+        self.model = AutoModelForCausalLM.from_pretrained(
             model_name,
-            load_in_4bit=True, 
             quantization_config=BitsAndBytesConfig(
+                load_in_4bit=True,
                 llm_int8_threshold=6.0,
                 llm_int8_has_fp16_weight=False
             ),
@@ -0,0 +1,84 @@
+from __future__ import annotations
+import copy
+from typing import List, Optional
+
+import torch
+
+
+class PrefixCache:
+    """Key/value cache of a fixed prompt prefix for decoder-only models.
+
+    The prefix is run through the model once; every generation then starts
+    from a copy of its ``past_key_values`` and only encodes the request
+    suffix. Each full prompt is tokenized as a whole and its prefix IDs are
+    sliced off, so the model sees exactly the uncached token sequence;
+    prompts whose tokens do not start with the prefix IDs are not covered.
+    Suffixes of a batch are padded on the left *after* the prefix, which the
+    attention mask (and the position ids derived from it) handles.
+    Encoder-decoder models attend bidirectionally over the whole input, so
+    their encoder states cannot be reused this way.
+    """
+
+    def __init__(self, model, tokenizer, prefix: str) -> None:
+        if model.config.is_encoder_decoder:
+            raise ValueError("Prefix caching only applies to decoder-only models.")
+        self.model = model
+        self.tokenizer = tokenizer
+        self.prefix = prefix
+        self.prefix_ids = tokenizer(prefix, return_tensors="pt").input_ids.to(model.device)
+        self._prefix_list = self.prefix_ids[0].tolist()
+        with torch.no_grad():
+            self.past_key_values = model(self.prefix_ids, use_cache=True).past_key_values
+
+    def _cache_for(self, batch_size: int):
+        cache = copy.deepcopy(self.past_key_values)
+        if batch_size == 1:
+            return cache
+        if hasattr(cache, "batch_repeat_interleave"):
+            cache.batch_repeat_interleave(batch_size)
+            return cache
+        # Legacy tuple-of-tuples cache
+        return tuple(tuple(t.repeat_interleave(batch_size, dim=0) for t in layer) for layer in cache)
+
+    def _suffix_ids(self, prompt: str) -> Optional[List[int]]:
+        if not prompt.startswith(self.prefix):
+            return None
+        ids = self.tokenizer(prompt).input_ids
+        n = len(self._prefix_list)
+        # A token merged across the boundary would change the prefix IDs
+        if ids[:n] != self._prefix_list or len(ids) == n:
+            return None
+        return ids[n:]
+
+    def covers(self, prompts: List[str]) -> bool:
+        """Whether every prompt tokenizes to the cached prefix IDs plus a suffix."""
+        return all(self._suffix_ids(p) is not None for p in prompts)
+
+    def generate(self, prompts: List[str], **generate_kwargs) -> List[str]:
+        """Generate a completion for each full prompt, reusing the prefix cache."""
+        suffixes = [self._suffix_ids(p) for p in prompts]
+        if any(s is None for s in suffixes):
+            raise ValueError("Prompt does not start with the cached prefix tokens.")
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        pad = self.tokenizer.pad_token_id
+        width = max(len(s) for s in suffixes)
+        suffix_ids = torch.tensor([[pad] * (width - len(s)) + s for s in suffixes], device=self.model.device)
+        suffix_mask = torch.tensor(
+            [[0] * (width - len(s)) + [1] * len(s) for s in suffixes], device=self.model.device
+        )
+        batch_size = len(prompts)
+        prefix_ids = self.prefix_ids.expand(batch_size, -1)
+        input_ids = torch.cat([prefix_ids, suffix_ids], dim=1)
+        attention_mask = torch.cat([torch.ones_like(prefix_ids), suffix_mask], dim=1)
+        with torch.no_grad():
+            outputs = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                past_key_values=self._cache_for(batch_size),
+                pad_token_id=pad,
+                **generate_kwargs,
+            )
+        # Rows hold prefix + suffix + completion: keep only the completion
+        completions = outputs[:, input_ids.shape[1]:]
+        return [self.tokenizer.decode(out, skip_special_tokens=True).strip() for out in completions]
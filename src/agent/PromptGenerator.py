@@ -1,21 +1,9 @@
-import json
+import warnings
 
-
-def generate_sql_prompt(schema: dict, user_request: str) -> str:
-    """
-    Builds a hardened prompt so the LLM:
-      • Parses the JSON schema
-      • Validates table/column names
-      • Generates exactly one optimized SQL query
-      • Emits ONLY the SQL (or a fixed ERROR message)
-    """
-    # Compact the schema to minimize prompt length while retaining table/column
-    # names. This avoids hitting the 512 token limit of models like Flan-T5.
-    schema_json = json.dumps(schema, indent=2, ensure_ascii=False)
-
-    prompt = f"""
-SYSTEM: You are an expert SQL query generator.
-SYSTEM: You will receive a JSON schema and a user request.
+# Static part of every SQL prompt. It comes first so decoder-only models can
+# encode it once and reuse its key/value cache (see agent.PrefixCache).
+SQL_PROMPT_PREFIX = """SYSTEM: You are an expert SQL query generator.
+SYSTEM: You will receive a database schema and a user request.
 
 -- Rules:
 1. Use UPPERCASE for all SQL keywords.
@@ -26,7 +14,7 @@ SYSTEM: You will receive a JSON schema and a user request.
 <details hidden>
 <!--
 THINK:
-- Parse schema_json.
+- Parse the schema: table(column:type, ...), FK lines link columns.
 - Map user_request to tables/cols.
 - Plan JOINs, filters, aggregates.
 - Validate names against schema.
@@ -34,16 +22,202 @@ THINK:
 -->
 </details>
 
--- Database Schema --
-{schema_json}
-
 -- Few-Shot Example --
 # Request: "Count users by country"
 SELECT country, COUNT(*) AS nombre_utilisateurs FROM users GROUP BY country;
 
+"""
+
+
+def _column_text(col) -> str:
+    if isinstance(col, dict):
+        text = f"{col['name']}:{col['type']}" if col.get("type") else col["name"]
+        return text + (" PK" if col.get("primary_key") else "")
+    return str(col)
+
+
+def _fk_line(table_name: str, fk: dict) -> str:
+    to_column = f".{fk['to_column']}" if fk.get("to_column") else ""
+    return f"  FK {table_name}.{fk['from_column']} -> {fk['to_table']}{to_column}"
+
+
+def compact_schema(schema: dict) -> str:
+    """Serialize ``schema`` as one ``table(col:type, ...)`` line per table.
+
+    Columns may be plain names or column dicts as returned by
+    ``DBManager.extract_table_metadata``; primary keys are marked ``PK`` and
+    each table's ``foreign_keys`` follow as ``FK a.x -> b.y`` lines.
+    """
+    lines = []
+    for table in schema.get("tables", []):
+        lines.append(f"{table['name']}({', '.join(_column_text(c) for c in table['columns'])})")
+        for fk in table.get("foreign_keys", []):
+            lines.append(_fk_line(table["name"], fk))
+    return "\n".join(lines)
+
+
+def generate_sql_prompt_suffix(schema: dict, user_request: str, db_type: str | None = None) -> str:
+    """Return the request-specific part of the prompt that follows ``SQL_PROMPT_PREFIX``."""
+    # Compact the schema to minimize prompt length while retaining table/column
+    # names. This avoids hitting the 512 token limit of models like Flan-T5.
+    schema_text = compact_schema(schema)
+    dialect = f"-- Dialect: {db_type}\n" if db_type else ""
+
+    suffix = f"""-- Database Schema --
+{dialect}{schema_text}
+
 -- Now, process this request:
 # Request: {user_request}
 
 -- Output your SQL below (and nothing else):"""
 
-    return prompt.strip()
+    return suffix.strip()
+
+
+def link_scores(matches: list[dict]) -> dict:
+    """Map linked tables and ``"table.column"`` names to their best linking score."""
+    scores: dict = {}
+    for m in matches:
+        # Schema elements are "table" or "column table"
+        parts = m["schema_element"].split(" ")
+        table = parts[-1]
+        keys = [table] + ([f"{table}.{parts[0]}"] if len(parts) > 1 else [])
+        for key in keys:
+            scores[key] = max(scores.get(key, 0.0), float(m["score"]))
+    return scores
+
+
+def fit_schema_to_budget(
+    schema: dict,
+    user_request: str,
+    tokenizer,
+    max_tokens: int | None = None,
+    scores: dict | None = None,
+    db_type: str | None = None,
+    reserve_tokens: int = 0,
+) -> dict:
+    """Drop the least relevant columns and tables until the prompt fits.
+
+    ``scores`` maps table names and ``"table.column"`` names to linking
+    scores; a column without its own score ranks just below its table.
+    Columns are removed lowest score first, and a table goes once it has
+    none left. ``max_tokens`` defaults to the tokenizer's maximum length,
+    of which ``reserve_tokens`` are kept free for the generated SQL
+    (decoder-only models share one context between prompt and output).
+
+    Each column, table header and foreign key line is tokenized once and
+    its count subtracted as it goes; the result is checked with a single
+    full tokenization, which only falls back to re-counting when token
+    merges across lines make the estimate fall short.
+    """
+    if max_tokens is None:
+        max_tokens = tokenizer.model_max_length
+        if max_tokens > 100_000:  # tokenizers without a real limit
+            return schema
+    budget = max_tokens - reserve_tokens
+    scores = scores or {}
+    tables = [dict(t, columns=list(t["columns"])) for t in schema.get("tables", [])]
+
+    def kept() -> dict:
+        # Foreign keys are only kept while both of their ends are
+        names = {t["name"] for t in tables if t["columns"]}
+        result = []
+        for t in tables:
+            if not t["columns"]:
+                continue
+            columns = {c["name"] if isinstance(c, dict) else c for c in t["columns"]}
+            fks = [
+                fk for fk in t.get("foreign_keys", [])
+                if fk["from_column"] in columns and fk["to_table"] in names
+            ]
+            result.append(dict(t, foreign_keys=fks))
+        return {"tables": result}
+
+    def n_tokens(text: str) -> int:
+        return len(tokenizer(text).input_ids)
+
+    def cost(text: str) -> int:
+        return len(tokenizer(text, add_special_tokens=False).input_ids)
+
+    if n_tokens(generate_sql_prompt({"tables": []}, user_request, db_type)) > budget:
+        warnings.warn(
+            f"The prompt without any schema already exceeds {budget} tokens; no table is kept."
+        )
+        return {"tables": []}
+    total = n_tokens(generate_sql_prompt(kept(), user_request, db_type))
+    if total <= budget:
+        return kept()
+
+    # Token cost of every line part, counted once
+    col_cost = {}
+    header_cost = {}
+    fk_lines = []  # [table, fk, cost, alive]
+    for t in tables:
+        header_cost[id(t)] = cost(f"{t['name']}()\n")
+        for col in t["columns"]:
+            col_cost[id(col)] = cost(", " + _column_text(col))
+        for fk in t.get("foreign_keys", []):
+            fk_lines.append([t, fk, cost(_fk_line(t["name"], fk) + "\n"), True])
+
+    candidates = []
+    for t in tables:
+        table_score = scores.get(t["name"], 0.0)
+        for position, col in enumerate(t["columns"]):
+            name = col["name"] if isinstance(col, dict) else col
+            score = scores.get(f"{t['name']}.{name}", table_score - 0.5)
+            candidates.append((score, -position, t, col))
+    candidates.sort(key=lambda c: (c[0], c[1]))
+
+    for _, _, table, col in candidates:
+        if total <= budget:
+            # The estimate may be low by a few merged tokens: confirm it
+            total = n_tokens(generate_sql_prompt(kept(), user_request, db_type))
+            if total <= budget:
+                break
+        table["columns"].remove(col)
+        total -= col_cost[id(col)]
+        name = col["name"] if isinstance(col, dict) else col
+        if not table["columns"]:
+            total -= header_cost[id(table)]
+        for line in fk_lines:
+            fk_table, fk, line_cost, alive = line
+            gone = (fk_table is table and (fk["from_column"] == name or not table["columns"])) or (
+                fk["to_table"] == table["name"] and not table["columns"]
+            )
+            if alive and gone:
+                line[3] = False
+                total -= line_cost
+
+    result = kept()
+    if tables and not result["tables"]:
+        warnings.warn(f"No table of the schema fits in {budget} prompt tokens.")
+    return result
+
+
+def generate_sql_prompt(
+    schema: dict,
+    user_request: str,
+    db_type: str | None = None,
+    tokenizer=None,
+    max_tokens: int | None = None,
+    scores: dict | None = None,
+    reserve_tokens: int = 0,
+) -> str:
+    """
+    Builds a hardened prompt so the LLM:
+      • Parses the compact schema
+      • Validates table/column names
+      • Generates exactly one optimized SQL query
+      • Emits ONLY the SQL (or a fixed ERROR message)
+
+    The prompt is ``SQL_PROMPT_PREFIX`` (rules and few-shot example, identical
+    for every request) followed by the schema and the request. Given a
+    ``tokenizer``, the schema is pruned with :func:`fit_schema_to_budget` so
+    the request is never cut off and ``reserve_tokens`` stay free for the
+    output of decoder-only models.
+    """
+    if tokenizer is not None:
+        schema = fit_schema_to_budget(
+            schema, user_request, tokenizer, max_tokens, scores, db_type, reserve_tokens
+        )
+    return SQL_PROMPT_PREFIX + generate_sql_prompt_suffix(schema, user_request, db_type)
@@ -0,0 +1,54 @@
+from __future__ import annotations
+import math
+from typing import List, Optional
+
+import torch
+from transformers import LogitsProcessor
+
+from agent.SQLValidator import SQLPrefixValidator
+
+
+class SQLConstrainedLogitsProcessor(LogitsProcessor):
+    """Mask tokens that would make the generated SQL invalid.
+
+    As in PICARD, only the ``top_k`` highest scoring tokens of each row are
+    checked against the row's :class:`SQLPrefixValidator`; if none of them
+    is valid the row is left unconstrained rather than stuck. Once a
+    statement is complete only the end-of-sequence token remains. The
+    prompt length is taken from the first call, so one processor serves a
+    single ``generate`` call.
+    """
+
+    def __init__(self, tokenizer, validators: List[SQLPrefixValidator], top_k: int = 16) -> None:
+        self.tokenizer = tokenizer
+        self.validators = validators
+        self.top_k = top_k
+        self.prompt_length: Optional[int] = None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        if self.prompt_length is None:
+            self.prompt_length = input_ids.shape[1]
+        eos = self.tokenizer.eos_token_id
+        rows = input_ids.shape[0]
+        for row in range(rows):
+            # Beams of the same example are laid out next to each other
+            validator = self.validators[row * len(self.validators) // rows]
+            generated = input_ids[row, self.prompt_length:].tolist()
+            text = self.tokenizer.decode(generated, skip_special_tokens=True)
+            allowed = []
+            if validator.state(text) == "complete":
+                allowed = [eos]
+            else:
+                for token in scores[row].topk(min(self.top_k, scores.shape[1])).indices.tolist():
+                    if token == eos:
+                        ok = validator.can_end(text)
+                    else:
+                        candidate = self.tokenizer.decode(generated + [token], skip_special_tokens=True)
+                        ok = validator.state(candidate) is not None
+                    if ok:
+                        allowed.append(token)
+            if allowed:
+                mask = torch.full_like(scores[row], -math.inf)
+                mask[allowed] = 0
+                scores[row] = scores[row] + mask
+        return scores
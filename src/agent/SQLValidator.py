@@ -0,0 +1,486 @@
+"""Incremental SQLite prefix validation, free of torch so it can be tested alone."""
+
+from __future__ import annotations
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set
+
+# Keywords and functions a generated SQLite query may use besides schema names
+SQL_WORDS = {
+    "select", "from", "where", "group", "by", "order", "having", "limit", "offset",
+    "join", "inner", "left", "outer", "cross", "natural", "on", "using", "as",
+    "and", "or", "not", "in", "is", "null", "like", "glob", "between", "exists",
+    "distinct", "all", "union", "intersect", "except", "case", "when", "then",
+    "else", "end", "asc", "desc", "with", "recursive", "values", "escape",
+    "collate", "nocase", "nulls", "first", "last", "true", "false", "cast",
+    "integer", "real", "text", "count", "sum", "avg", "min", "max", "total",
+    "coalesce", "ifnull", "iif", "nullif", "lower", "upper", "length", "abs",
+    "round", "substr", "instr", "replace", "trim", "date", "time", "datetime",
+    "julianday", "strftime", "group_concat",
+}
+
+# Words that shape the statement; every other word is a name (schema element,
+# alias or function)
+KEYWORDS = {
+    "select", "from", "where", "group", "by", "order", "having", "limit", "offset",
+    "join", "inner", "left", "right", "full", "outer", "cross", "natural", "on",
+    "using", "as", "and", "or", "not", "in", "is", "null", "like", "glob", "between",
+    "exists", "distinct", "all", "union", "intersect", "except", "case", "when",
+    "then", "else", "end", "asc", "desc", "with", "recursive", "escape", "collate",
+    "nulls", "true", "false",
+}
+
+# Clauses of a SELECT, in the only order they may appear
+CLAUSES = ["select", "from", "where", "group", "having", "order", "limit", "offset"]
+
+# Words that may follow each join modifier
+JOIN_NEXT = {
+    "natural": {"left", "right", "full", "inner", "cross", "join"},
+    "left": {"outer", "join"},
+    "right": {"outer", "join"},
+    "full": {"outer", "join"},
+    "outer": {"join"},
+    "inner": {"join"},
+    "cross": {"join"},
+}
+
+OPERATORS = {"=", "==", "<", ">", "<=", ">=", "!=", "<>", "+", "-", "*", "/", "%", "||"}
+
+# Spider-style aliases (T1, T2, ...) may be used before the FROM declaring them
+FORWARD_ALIAS = re.compile(r"t\d*")
+
+# Complete statements whose EXPLAIN result is remembered per validator
+EXPLAIN_CACHE_SIZE = 1024
+
+
+class Trie:
+    """Prefix tree over lowercase words."""
+
+    def __init__(self, words: Iterable[str] = ()) -> None:
+        self.root: Dict[str, dict] = {}
+        for word in words:
+            self.add(word)
+
+    def add(self, word: str) -> None:
+        node = self.root
+        for ch in word.lower():
+            node = node.setdefault(ch, {})
+        node["$"] = {}
+
+    def _node(self, prefix: str) -> Optional[dict]:
+        node = self.root
+        for ch in prefix:
+            node = node.get(ch)
+            if node is None:
+                return None
+        return node
+
+    def has_prefix(self, prefix: str) -> bool:
+        return self._node(prefix) is not None
+
+    def __contains__(self, word: str) -> bool:
+        node = self._node(word)
+        return node is not None and "$" in node
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class _Frame:
+    """Parser state of one nesting level: the statement or a parenthesis.
+
+    ``kind`` is ``query`` (a SELECT), ``paren`` (a parenthesis that may
+    still turn into a subquery), ``args`` (function arguments), ``cols``
+    (a CTE column list) or ``case``. ``expect`` is ``operand`` while a term
+    is missing, ``operator`` once one is complete and ``alias`` after AS.
+    ``need`` restricts the next word, e.g. to ``by`` after GROUP.
+    """
+
+    __slots__ = ("kind", "clause", "expect", "need", "prev", "alias_ok", "qualified", "empty")
+
+    def __init__(self, kind: str, clause: Optional[str] = None) -> None:
+        self.kind = kind
+        self.clause = clause
+        self.expect = "operand"
+        self.need: Optional[Set[str]] = None
+        self.prev: Optional[str] = None
+        self.alias_ok = False
+        self.qualified = False
+        self.empty = True
+
+    def copy(self) -> "_Frame":
+        frame = _Frame(self.kind, self.clause)
+        for slot in self.__slots__:
+            setattr(frame, slot, getattr(self, slot))
+        return frame
+
+
+class SQLPrefixValidator:
+    """Incrementally check that a text can still grow into a valid query.
+
+    The text is parsed as a SELECT (optionally behind WITH): clauses must
+    come in SQLite's order, and every token must be one the statement can
+    take next - a term after an operator or clause keyword, an operator,
+    comma, alias or next clause after a term, BY after GROUP/ORDER, and so
+    on. Names must be keywords or functions, tables or columns of the
+    database (looked up in a :class:`Trie`), or declared aliases;
+    qualifiers such as ``T1.`` may precede their declaration. The word
+    being typed only has to be a prefix of a word allowed at that point.
+
+    A ``;`` completes the statement once it is syntactically whole and
+    ``EXPLAIN`` prepares it against an empty in-memory copy of the schema,
+    which catches unknown columns, misplaced aliases and anything the
+    parser lets through.
+    """
+
+    def __init__(self, schema: Dict[str, List[str]]) -> None:
+        self.tables = {t.lower() for t in schema}
+        self.columns = {c.lower() for cols in schema.values() for c in cols}
+        # Structural keywords are parsed as such, never as names
+        self.trie = Trie((SQL_WORDS - KEYWORDS) | self.tables | self.columns)
+        self._schema = schema
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._prepared: "OrderedDict[str, bool]" = OrderedDict()
+
+    @classmethod
+    def from_db(cls, db) -> "SQLPrefixValidator":
+        """Build the validator from a ``DBManager``'s tables and columns."""
+        return cls(db.extract_column_table_pairs())
+
+    def prepares(self, sql: str) -> bool:
+        """Whether SQLite compiles *sql* against an empty copy of the schema."""
+        with self._lock:
+            if sql in self._prepared:
+                self._prepared.move_to_end(sql)
+                return self._prepared[sql]
+            if self._conn is None:
+                self._conn = sqlite3.connect(":memory:", check_same_thread=False)
+                for table, columns in self._schema.items():
+                    cols = ", ".join(_quote(c) for c in columns) or _quote("rowid_")
+                    self._conn.execute(f"CREATE TABLE {_quote(table)} ({cols})")
+            try:
+                self._conn.execute(f"EXPLAIN {sql}").fetchall()
+                ok = True
+            except (sqlite3.Error, sqlite3.Warning, ValueError):
+                ok = False
+            self._prepared[sql] = ok
+            if len(self._prepared) > EXPLAIN_CACHE_SIZE:
+                self._prepared.popitem(last=False)
+            return ok
+
+    def state(self, text: str) -> Optional[str]:
+        """Return ``"complete"``, ``"open"`` or ``None`` if *text* cannot be valid SQL."""
+        stack = [_Frame("query")]
+        stack[0].need = {"select", "with"}
+        aliases: Set[str] = set()
+        i, n = 0, len(text)
+        while i < n:
+            ch = text[i]
+            if ch.isspace():
+                i += 1
+            elif ch in "'\"`":
+                end = text.find(ch, i + 1)
+                # Quotes are escaped by doubling them
+                while end != -1 and end + 1 < n and text[end + 1] == ch:
+                    end = text.find(ch, end + 2)
+                if not self._step(stack, aliases, "str", ch):
+                    return None
+                if end == -1:
+                    return "open"  # inside a literal anything goes
+                i = end + 1
+            elif ch.isalpha() or ch == "_":
+                j = i
+                while j < n and (text[j].isalnum() or text[j] == "_"):
+                    j += 1
+                word = text[i:j].lower()
+                if j == n:
+                    return "open" if self._can_complete(stack, aliases, word) else None
+                if text[j] == ".":
+                    kind, j = "qual", j + 1
+                else:
+                    kind = "kw" if word in KEYWORDS else "name"
+                if not self._step(stack, aliases, kind, word):
+                    return None
+                i = j
+            elif ch.isdigit():
+                while i < n and (text[i].isalnum() or text[i] == "."):
+                    i += 1
+                if not self._step(stack, aliases, "num", ch):
+                    return None
+            elif ch == ";":
+                root = stack[0]
+                if (
+                    len(stack) > 1
+                    or root.expect != "operator"
+                    or root.need
+                    or root.clause not in CLAUSES
+                    or text[i + 1:].strip()
+                    or not self.prepares(text[:i])
+                ):
+                    return None
+                return "complete"
+            elif ch in "(),":
+                if not self._step(stack, aliases, ch, ch):
+                    return None
+                i += 1
+            else:
+                op = text[i:i + 2] if text[i:i + 2] in OPERATORS else ch
+                if op in ("!", "|") and i + 1 == n:
+                    op = op + "=" if op == "!" else "||"  # still being typed
+                if op not in OPERATORS or not self._step(stack, aliases, "op", op):
+                    return None
+                i += len(text[i:i + 2]) if text[i:i + 2] in OPERATORS else 1
+        return "open"
+
+    def can_end(self, text: str) -> bool:
+        """Whether generation may stop here (the caller appends the ``;``)."""
+        return bool(text.strip()) and self.state(text + ";") == "complete"
+
+    def _can_complete(self, stack: List[_Frame], aliases: Set[str], prefix: str) -> bool:
+        """Whether the word being typed can still become a token allowed here."""
+        for keyword in KEYWORDS:
+            if keyword.startswith(prefix) and self._step([f.copy() for f in stack], set(aliases), "kw", keyword):
+                return True
+        f = stack[-1]
+        if f.expect == "operand" and not f.qualified and FORWARD_ALIAS.fullmatch(prefix):
+            return True  # a qualifier such as T1. being typed
+        return self._step([f.copy() for f in stack], set(aliases), "name", prefix, partial=True)
+
+    def _known(self, word: str, aliases: Set[str], partial: bool) -> bool:
+        if partial:
+            return self.trie.has_prefix(word) or any(a.startswith(word) for a in aliases)
+        return word in self.trie or word in aliases
+
+    def _step(
+        self, stack: List[_Frame], aliases: Set[str], kind: str, tok: str, partial: bool = False
+    ) -> bool:
+        """Apply one token to the parser state; False if it cannot come next."""
+        f = stack[-1]
+        if f.need is not None:
+            if tok not in f.need:
+                return False
+            f.need = None
+        ok = self._operand(stack, aliases, kind, tok, partial) if f.expect != "operator" else (
+            self._operator(stack, aliases, kind, tok, partial)
+        )
+        if ok and stack[-1] is f:
+            f.prev, f.empty = tok, False
+        return ok
+
+    def _operand(self, stack: List[_Frame], aliases: Set[str], kind: str, tok: str, partial: bool) -> bool:
+        f = stack[-1]
+        if f.expect == "alias":
+            if kind not in ("name", "str"):
+                return False
+            aliases.add(tok)
+            f.expect, f.alias_ok = "operator", False
+            return True
+        if f.qualified:
+            f.qualified = False
+            if kind == "name" and self._known(tok, aliases, partial):
+                return self._term(f, alias=True)
+            return tok == "*" and self._term(f, alias=False)
+        if kind == "kw":
+            if f.kind == "paren" and f.empty and tok in ("select", "with"):
+                f.kind = "query"
+            if f.kind == "query" and tok == "select" and (f.clause is None or f.clause == "compound"):
+                f.clause = "select"
+                return True
+            if f.kind == "query" and tok == "with" and f.clause is None:
+                f.clause = "with"
+                return True
+            if tok == "recursive":
+                return f.prev == "with"
+            if tok == "by":
+                return f.prev in ("group", "order")
+            if tok == "all" and f.prev == "union":
+                f.need = {"select"}
+                return True
+            if tok in ("distinct", "all"):
+                return f.prev == "select" or (tok == "distinct" and f.kind == "args" and f.empty)
+            if tok == "join":
+                return f.prev in JOIN_NEXT
+            if tok in JOIN_NEXT:
+                f.need = JOIN_NEXT[tok]
+                return f.prev in JOIN_NEXT
+            if tok == "not":
+                return True
+            if tok == "exists":
+                f.need = {"("}
+                return True
+            if tok == "case":
+                stack.append(_Frame("case"))
+                return True
+            if tok == "when":
+                return f.kind == "case" and f.prev is None
+            if tok in ("null", "true", "false"):
+                return self._term(f, alias=False)
+            return False
+        if kind == "name":
+            if f.kind == "cols" or (f.kind == "query" and f.clause == "with"):
+                aliases.add(tok)  # CTE name or column
+                return self._term(f, alias=False)
+            if f.kind == "query" and f.clause == "from" and f.prev in ("from", "join", ","):
+                known = self.tables | aliases
+                if not (any(t.startswith(tok) for t in known) if partial else tok in known):
+                    return False
+                return self._term(f, alias=True)
+            if not self._known(tok, aliases, partial):
+                return False
+            return self._term(f, alias=True)
+        if kind == "qual":
+            if tok not in self.tables and tok not in aliases and not FORWARD_ALIAS.fullmatch(tok):
+                return False
+            f.qualified = True
+            return True
+        if kind in ("num", "str"):
+            return self._term(f, alias=False)
+        if kind == "op":
+            if tok == "*":
+                if f.prev == "select" or f.prev == "distinct" or (f.kind == "args" and f.empty):
+                    return self._term(f, alias=False)
+                return False
+            return tok in ("-", "+")  # sign
+        if kind == "(":
+            stack.append(_Frame("paren"))
+            return True
+        if kind == ")":
+            # Functions without arguments, e.g. random()
+            return f.kind == "args" and f.empty and self._close(stack)
+        return False
+
+    def _operator(self, stack: List[_Frame], aliases: Set[str], kind: str, tok: str, partial: bool) -> bool:
+        f = stack[-1]
+        if kind == "op":
+            f.expect = "operand"
+            return True
+        if kind == ",":
+            if f.kind == "case" or (f.kind == "query" and f.clause not in ("select", "from", "group", "order", "limit", "with")):
+                return False
+            f.expect, f.alias_ok = "operand", False
+            return True
+        if kind == ")":
+            if f.kind == "case" or (f.kind == "query" and f.clause not in CLAUSES):
+                return False
+            return self._close(stack)
+        if kind == "(":
+            # Function call, or the column list of a CTE, right after a name
+            if f.prev in KEYWORDS or not (f.prev[0].isalpha() or f.prev[0] == "_"):
+                return False
+            stack.append(_Frame("cols" if f.kind == "query" and f.clause == "with" else "args"))
+            return True
+        if kind in ("name", "str"):
+            # Implicit alias; a schema name here is more likely a missing comma
+            if not f.alias_ok or (kind == "name" and (tok in self.columns or tok in self.tables)):
+                return partial and f.alias_ok
+            aliases.add(tok)
+            f.alias_ok = False
+            return True
+        if kind != "kw":
+            return False
+        if tok in ("and", "or", "like", "glob", "escape", "between", "is"):
+            f.expect, f.alias_ok = "operand", False
+            return True
+        if tok == "in":
+            f.expect, f.need, f.alias_ok = "operand", {"("}, False
+            return True
+        if tok == "not":
+            f.need, f.alias_ok = {"in", "like", "glob", "between", "null"}, False
+            return True
+        if tok == "null":
+            return f.prev == "not"  # x NOT NULL
+        if tok == "collate":
+            f.expect = "operand"
+            return True
+        if tok == "as":
+            if f.kind == "args":
+                f.expect = "operand"  # CAST(x AS type)
+                return True
+            if f.kind == "query" and f.clause == "with":
+                f.expect, f.need = "operand", {"("}
+                return True
+            if f.alias_ok:
+                f.expect = "alias"
+                return True
+            return False
+        if tok in ("asc", "desc"):
+            f.alias_ok = False
+            return f.kind == "query" and f.clause == "order" and f.prev not in ("asc", "desc")
+        if tok == "nulls":
+            f.need = {"first", "last"}
+            return f.kind == "query" and f.clause == "order"
+        if tok in ("first", "last"):
+            return f.prev == "nulls"
+        if f.kind == "case":
+            if tok in ("when", "then", "else"):
+                f.expect = "operand"
+                return True
+            if tok == "end":
+                return self._close(stack)
+            return False
+        if f.kind != "query":
+            return False
+        return self._clause(f, tok)
+
+    def _clause(self, f: _Frame, tok: str) -> bool:
+        """Keywords that move a query frame to its next clause or join."""
+        if tok == "select":
+            if f.clause != "with":
+                return False
+            f.clause, f.expect = "select", "operand"
+            return True
+        if tok in ("union", "intersect", "except"):
+            if f.clause not in CLAUSES:
+                return False
+            f.clause, f.expect, f.alias_ok = "compound", "operand", False
+            f.need = {"select", "all"} if tok == "union" else {"select"}
+            return True
+        if tok == "all":
+            return False
+        if tok in CLAUSES:
+            if f.clause not in CLAUSES or CLAUSES.index(tok) <= CLAUSES.index(f.clause):
+                return False
+            if tok == "offset" and f.clause != "limit":
+                return False
+            f.clause, f.expect, f.alias_ok = tok, "operand", False
+            if tok in ("group", "order"):
+                f.need = {"by"}
+            return True
+        if f.clause != "from":
+            return False
+        if tok == "join":
+            f.expect, f.alias_ok = "operand", False
+            return True
+        if tok in JOIN_NEXT:
+            f.expect, f.alias_ok, f.need = "operand", False, JOIN_NEXT[tok]
+            return True
+        if tok == "on":
+            f.expect, f.alias_ok = "operand", False
+            return True
+        if tok == "using":
+            f.expect, f.alias_ok, f.need = "operand", False, {"("}
+            return True
+        return False
+
+    @staticmethod
+    def _term(f: _Frame, alias: bool) -> bool:
+        """A term is complete: an operator, comma or clause may follow."""
+        f.expect = "operator"
+        f.alias_ok = f.kind == "query" and f.clause in ("select", "from") and (alias or f.clause == "select")
+        return True
+
+    @staticmethod
+    def _close(stack: List[_Frame]) -> bool:
+        """Pop the innermost frame; its parent now holds a complete term."""
+        if len(stack) < 2:
+            return False
+        stack.pop()
+        parent = stack[-1]
+        parent.expect = "operator"
+        parent.alias_ok = parent.kind == "query" and parent.clause in ("select", "from")
+        parent.prev, parent.empty = ")", False
+        return True
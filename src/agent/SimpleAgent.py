@@ -1,7 +1,8 @@
 from __future__ import annotations
 import torch
-from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+from transformers import AutoModelForSeq2SeqLM, AutoTokenizer, LogitsProcessorList
 from agent import generate_sql_prompt
+from agent.SQLConstraint import SQLConstrainedLogitsProcessor, SQLPrefixValidator
 
 class SimpleAgent:
     """Lightweight NL2SQL agent using an off-the-shelf model.
@@ -19,12 +20,28 @@ class SimpleAgent:
         self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
         self.model.to(self.device)
 
-    def generate(self, prompt: str) -> str:
+    def generate(self, prompt: str, validator: SQLPrefixValidator | None = None) -> str:
         """Generate a SQL query for *question* given the database *schema*."""
-        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
+        return self.generate_batch([prompt], [validator] if validator else None)[0]
+
+    def generate_batch(
+        self, prompts: list[str], validators: list[SQLPrefixValidator] | None = None
+    ) -> list[str]:
+        """Generate one SQL query per prompt with a single padded ``generate`` call.
+
+        With ``validators`` (one per prompt) decoding is constrained to SQL
+        that stays valid for each prompt's database.
+        """
+        constraint = {}
+        if validators:
+            constraint["logits_processor"] = LogitsProcessorList(
+                [SQLConstrainedLogitsProcessor(self.tokenizer, validators)]
+            )
+        inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.device)
         outputs = self.model.generate(
             **inputs,
             max_new_tokens=150,
             do_sample=False,
+            **constraint,
         )
-        return self.tokenizer.decode(outputs[0], skip_special_tokens=True).strip()
\ No newline at end of file
+        return [self.tokenizer.decode(out, skip_special_tokens=True).strip() for out in outputs]
@@ -1,16 +1,31 @@
+import hashlib
 import json
 import os
+import bisect
+import random
+import shutil
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import torch
 from torch.utils.data import Dataset
 from transformers import AutoTokenizer
-from torch.utils.data import DataLoader, random_split
+from torch.utils.data import DataLoader, Sampler, Subset, random_split
 
 class SpiderFRDataset(Dataset):
     """Dataset loader for the French version of Spider.
 
     The loader combines the ``train_spider.json``, ``train_others.json`` and
-    ``dev_spider.json`` files from ``data/spider-fr``. Questions and SQL queries
-    are tokenized using Spider's ``tokenize`` utility and then converted to
-    token IDs with a HuggingFace ``AutoTokenizer``.
+    ``dev_spider.json`` files from ``data/spider-fr``. The pre-tokenized
+    ``question_toks`` and ``query_toks`` are converted to token IDs with a
+    HuggingFace ``AutoTokenizer``.
+
+    Tokenization runs once: the unpadded IDs are stored under
+    ``cache_dir/<key>`` as flat ``.npy`` arrays with an offsets index, where
+    ``key`` hashes the tokenizer name, the maximum lengths and the data
+    files. Later constructions only memory-map them, and items are sliced
+    from the maps on access. Items are left unpadded for
+    :class:`DynamicPaddingCollator` unless ``pad_to_max_length`` is set.
     """
     
     DATA_FILES = [
@@ -24,76 +39,361 @@ class SpiderFRDataset(Dataset):
         tokenizer_name: str = "google/mt5-small",
         max_question_length: int = 128,
         max_query_length: int = 256,
+        cache_dir: str = "cache/spider-fr",
+        pad_to_max_length: bool = False,
     ) -> None:
-        self.questions, self.questions_toks = [], []
-        self.queries, self.queries_toks = [], []
-        self.db_ids = []
+        self.pad_to_max_length = pad_to_max_length
+        self.max_question_length = max_question_length
+        self.max_query_length = max_query_length
+        key = self.cache_key(tokenizer_name, max_question_length, max_query_length)
+        self.cache_path = os.path.join(cache_dir, key)
+        if not os.path.exists(os.path.join(self.cache_path, "meta.json")):
+            self._build(tokenizer_name)
+
+        with open(os.path.join(self.cache_path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.questions: List[str] = meta["questions"]
+        self.db_ids: List[str] = meta["db_ids"]
+        self.pad_token_id: int = meta["pad_token_id"]
+        self.bos_token_id: Optional[int] = meta.get("bos_token_id")
+        self.eos_token_id: Optional[int] = meta.get("eos_token_id")
+        self._arrays: Optional[Dict[str, np.ndarray]] = None
+
+    def cache_key(self, tokenizer_name: str, max_question_length: int, max_query_length: int) -> str:
+        digest = hashlib.sha1(f"{tokenizer_name}\0{max_question_length}\0{max_query_length}".encode("utf-8"))
+        for path in self.DATA_FILES:
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+        return digest.hexdigest()
+
+    def _build(self, tokenizer_name: str) -> None:
+        questions, questions_toks, queries_toks, db_ids = [], [], [], []
         for path in self.DATA_FILES:
             with open(path, "r", encoding="utf-8") as f:
                 for rec in json.load(f):
-                    self.db_ids.append(rec["db_id"])
-                    self.questions.append(rec["question"])
-                    self.questions_toks.append(rec["question_toks"])
-                    self.queries.append(rec["query_toks"])
-                    self.queries_toks.append(rec["query_toks"])
-
-        tokenizer = AutoTokenizer.from_pretrained(tokenizer_name, use_fast=False)
+                    db_ids.append(rec["db_id"])
+                    questions.append(rec["question"])
+                    questions_toks.append(rec["question_toks"])
+                    queries_toks.append(rec["query_toks"])
 
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_name, use_fast=True)
         enc_questions = tokenizer(
-            self.questions_toks,
-            is_split_into_words=True,
-            padding="max_length",
-            truncation=True,
-            max_length=max_question_length,
-            return_tensors="pt",
-        )
-
+            questions_toks, is_split_into_words=True, truncation=True, max_length=self.max_question_length
+        ).input_ids
         enc_queries = tokenizer(
-            self.queries_toks,
-            is_split_into_words=True,
-            padding="max_length",
-            truncation=True,
-            max_length=max_query_length,
-            return_tensors="pt",
+            queries_toks, is_split_into_words=True, truncation=True, max_length=self.max_query_length
         ).input_ids
 
-        self.input_ids = enc_questions.input_ids
-        self.attention_mask = enc_questions.attention_mask
-        self.labels = enc_queries
+        # Build in a scratch directory then rename so readers never see a partial cache
+        tmp = self.cache_path + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name, sequences in (("question", enc_questions), ("query", enc_queries)):
+            offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+            np.cumsum([len(ids) for ids in sequences], out=offsets[1:])
+            ids = np.fromiter((t for seq in sequences for t in seq), dtype=np.int32, count=int(offsets[-1]))
+            np.save(os.path.join(tmp, f"{name}_ids.npy"), ids)
+            np.save(os.path.join(tmp, f"{name}_offsets.npy"), offsets)
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "questions": questions,
+                    "db_ids": db_ids,
+                    # Causal LM tokenizers such as LLaMA's have no pad token
+                    "pad_token_id": tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id,
+                    "bos_token_id": tokenizer.bos_token_id,
+                    "eos_token_id": tokenizer.eos_token_id,
+                },
+                f,
+                ensure_ascii=False,
+            )
+        shutil.rmtree(self.cache_path, ignore_errors=True)
+        os.replace(tmp, self.cache_path)
+
+    @property
+    def arrays(self) -> Dict[str, np.ndarray]:
+        # Mapped on first access so every DataLoader worker maps its own view
+        if self._arrays is None:
+            self._arrays = {
+                name: np.load(os.path.join(self.cache_path, f"{name}.npy"), mmap_mode="r")
+                for name in ("question_ids", "question_offsets", "query_ids", "query_offsets")
+            }
+        return self._arrays
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_arrays"] = None
+        return state
+
+    def _ids(self, name: str, idx: int) -> np.ndarray:
+        offsets = self.arrays[f"{name}_offsets"]
+        return self.arrays[f"{name}_ids"][offsets[idx]:offsets[idx + 1]]
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """Question plus query length of every item, read from the offsets."""
+        return np.diff(self.arrays["question_offsets"]) + np.diff(self.arrays["query_offsets"])
 
     def __len__(self):
-        return self.input_ids.size(0)
+        return len(self.db_ids)
 
     def __getitem__(self, idx):
+        question = torch.from_numpy(self._ids("question", idx).astype(np.int64))
+        labels = torch.from_numpy(self._ids("query", idx).astype(np.int64))
+        attention_mask = torch.ones_like(question)
+        if self.pad_to_max_length:
+            question = pad_to(question, self.max_question_length, self.pad_token_id)
+            attention_mask = pad_to(attention_mask, self.max_question_length, 0)
+            labels = pad_to(labels, self.max_query_length, self.pad_token_id)
         return {
-            "input_ids": self.input_ids[idx],
-            "attention_mask": self.attention_mask[idx],
-            "labels": self.labels[idx],
+            "input_ids": question,
+            "attention_mask": attention_mask,
+            "labels": labels,
             "db_id": self.db_ids[idx],
         }
 
+
+def pad_to(ids: torch.Tensor, length: int, value: int) -> torch.Tensor:
+    """Right-pad a 1-D tensor with *value* up to *length*."""
+    out = torch.full((length,), value, dtype=ids.dtype)
+    out[: len(ids)] = ids
+    return out
+
+
+class DynamicPaddingCollator:
+    """Pad each batch only to its longest member.
+
+    Labels are padded with ``label_pad_token_id`` (-100 by default) so the
+    loss ignores padding. ``db_id`` strings are kept as a list unless
+    ``keep_db_id`` is false, as the HF ``Trainer`` passes every key to the
+    model.
+    """
+
+    def __init__(
+        self,
+        pad_token_id: int,
+        label_pad_token_id: int = -100,
+        pad_to_multiple_of: Optional[int] = None,
+        keep_db_id: bool = True,
+    ) -> None:
+        self.pad_token_id = pad_token_id
+        self.label_pad_token_id = label_pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+        self.keep_db_id = keep_db_id
+
+    def _stack(self, seqs: List[torch.Tensor], value: int) -> torch.Tensor:
+        length = max(len(s) for s in seqs)
+        if self.pad_to_multiple_of:
+            length = -(-length // self.pad_to_multiple_of) * self.pad_to_multiple_of
+        return torch.stack([pad_to(s, length, value) for s in seqs])
+
+    def __call__(self, features: List[Dict[str, Any]]) -> Dict[str, Any]:
+        batch = {
+            "input_ids": self._stack([f["input_ids"] for f in features], self.pad_token_id),
+            "attention_mask": self._stack([f["attention_mask"] for f in features], 0),
+            "labels": self._stack([f["labels"] for f in features], self.label_pad_token_id),
+        }
+        if self.keep_db_id and "db_id" in features[0]:
+            batch["db_id"] = [f["db_id"] for f in features]
+        return batch
+
+
+class PackedCollator:
+    """Flatten a batch of packed rows into a single ``[1, total]`` sequence.
+
+    transformers only reads restarting ``position_ids`` as example
+    boundaries when the batch holds one sequence; a ``[batch, seq_len]``
+    batch gets plain causal attention on recent releases, letting later
+    examples attend to earlier ones. Like ``DataCollatorWithFlattening``,
+    the rows are therefore concatenated instead of stacked.
+    """
+
+    def __call__(self, features: List[Dict[str, Any]]) -> Dict[str, torch.Tensor]:
+        return {
+            key: torch.cat([f[key] for f in features]).unsqueeze(0)
+            for key in ("input_ids", "labels", "position_ids")
+        }
+
+
+class LengthGroupedBatchSampler(Sampler):
+    """Yield batches of indices with similar lengths.
+
+    Indices are shuffled, cut into mega-batches of ``batch_size *
+    mega_batch_mult``, sorted by length inside each mega-batch and split
+    into batches whose order is shuffled again. Batches therefore stay
+    random across epochs while holding little padding. Without ``shuffle``
+    the whole dataset is sorted, which suits evaluation.
+    """
+
+    def __init__(
+        self,
+        lengths: Sequence[int],
+        batch_size: int,
+        shuffle: bool = True,
+        mega_batch_mult: int = 50,
+        seed: int = 0,
+    ) -> None:
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.mega_batch_size = batch_size * mega_batch_mult
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def __iter__(self) -> Iterator[List[int]]:
+        indices = list(range(len(self.lengths)))
+        if self.shuffle:
+            rng = random.Random(self.seed + self.epoch)
+            rng.shuffle(indices)
+            groups = [indices[i:i + self.mega_batch_size] for i in range(0, len(indices), self.mega_batch_size)]
+        else:
+            groups = [indices]
+        batches = []
+        for group in groups:
+            group.sort(key=lambda i: self.lengths[i], reverse=True)
+            batches.extend(group[i:i + self.batch_size] for i in range(0, len(group), self.batch_size))
+        if self.shuffle:
+            rng.shuffle(batches)
+            self.epoch += 1
+        return iter(batches)
+
+    def __len__(self) -> int:
+        return -(-len(self.lengths) // self.batch_size)
+
+
+def subset_lengths(dataset) -> List[int]:
+    """Item lengths of a dataset with a ``lengths`` attribute, or of a ``Subset`` of one."""
+    if isinstance(dataset, Subset):
+        lengths = subset_lengths(dataset.dataset)
+        return [lengths[i] for i in dataset.indices]
+    return list(dataset.lengths)
+
+
+class CausalLMDataset(Dataset):
+    """Question + SQL examples of a :class:`SpiderFRDataset` for causal LM training.
+
+    Wraps the dataset or a ``Subset`` of it. Each example is the question
+    IDs followed by the query IDs and EOS, truncated to ``max_length``; only
+    the query is labelled, question tokens get -100. Items are unpadded, for
+    :class:`DynamicPaddingCollator`.
+    """
+
+    def __init__(self, dataset, max_length: int = 512) -> None:
+        self.dataset = dataset
+        self.max_length = max_length
+        base = dataset
+        while isinstance(base, Subset):
+            base = base.dataset
+        self.pad_token_id = base.pad_token_id
+        self.bos_token_id = base.bos_token_id
+        self.eos_token_id = base.eos_token_id
+        self.lengths: List[int] = [len(self.example(i)[0]) for i in range(len(dataset))]
+
+    def example(self, idx: int) -> tuple:
+        """Input IDs and labels of one prompt + SQL example."""
+        item = self.dataset[idx]
+        question, query = item["input_ids"].tolist(), item["labels"].tolist()
+        if query and query[0] == self.bos_token_id:
+            query = query[1:]
+        if self.eos_token_id is not None and (not query or query[-1] != self.eos_token_id):
+            query.append(self.eos_token_id)
+        ids = (question + query)[: self.max_length]
+        labels = ([-100] * len(question) + query)[: self.max_length]
+        return ids, labels
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        ids, labels = self.example(idx)
+        input_ids = torch.tensor(ids)
+        return {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids), "labels": torch.tensor(labels)}
+
+
+class PackedCausalDataset(CausalLMDataset):
+    """Pack :class:`CausalLMDataset` examples into sequences of ``seq_len`` tokens.
+
+    Examples are assigned to rows of at most ``seq_len`` tokens by best-fit
+    decreasing. Rows carry ``position_ids`` that restart at 0 for every
+    example and no ``attention_mask``; batch them with
+    :class:`PackedCollator`, which flattens a batch into one sequence. With
+    ``attn_implementation="flash_attention_2"``, transformers turns the
+    restarts of that single sequence into variable-length attention, so
+    examples never attend to each other. The first token of an example is a
+    question token, so no label crosses a boundary either.
+    """
+
+    def __init__(self, dataset, seq_len: int = 512) -> None:
+        super().__init__(dataset, seq_len)
+        self.seq_len = seq_len
+        sizes = self.lengths
+        # Best-fit decreasing: each example goes to the fullest row it fits in
+        self.rows: List[List[int]] = []
+        free: List[tuple] = []  # sorted (remaining space, row)
+        for idx in sorted(range(len(sizes)), key=lambda i: sizes[i], reverse=True):
+            pos = bisect.bisect_left(free, (sizes[idx], -1))
+            if pos == len(free):
+                row, space = len(self.rows), self.seq_len
+                self.rows.append([])
+            else:
+                space, row = free.pop(pos)
+            self.rows[row].append(idx)
+            if space - sizes[idx] > 0:
+                bisect.insort(free, (space - sizes[idx], row))
+        self.example_tokens = sum(sizes)
+        self.lengths = [seq_len] * len(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, idx):
+        ids, labels, positions = [], [], []
+        for example in self.rows[idx]:
+            example_ids, example_labels = self.example(example)
+            ids += example_ids
+            labels += example_labels
+            positions += range(len(example_ids))
+        return {
+            "input_ids": torch.tensor(ids),
+            "labels": torch.tensor(labels),
+            "position_ids": torch.tensor(positions),
+        }
+
+    def efficiency(self) -> float:
+        """Share of non-padding tokens across all rows."""
+        return self.example_tokens / max(1, len(self.rows) * self.seq_len)
+
+
 def split_and_load(
     dataset: SpiderFRDataset,
     split_ratio: float = 0.8,
     batch_size: int = 16,
     num_workers: int = 0,
 ) -> tuple[DataLoader, DataLoader]:
-    """Split ``dataset`` into train/validation subsets and return dataloaders."""
+    """Split ``dataset`` into train/validation subsets and return dataloaders.
+
+    Batches are grouped by length and padded to their longest member.
+    """
 
     train_size = int(len(dataset) * split_ratio)
     val_size = len(dataset) - train_size
     train_ds, val_ds = random_split(dataset, [train_size, val_size])
+    collator = DynamicPaddingCollator(dataset.pad_token_id)
 
     train_loader = DataLoader(
         train_ds,
-        batch_size=batch_size,
-        shuffle=True,
+        batch_sampler=LengthGroupedBatchSampler(subset_lengths(train_ds), batch_size, shuffle=True),
+        collate_fn=collator,
         num_workers=num_workers,
     )
     val_loader = DataLoader(
         val_ds,
-        batch_size=batch_size,
-        shuffle=False,
+        batch_sampler=LengthGroupedBatchSampler(subset_lengths(val_ds), batch_size, shuffle=False),
+        collate_fn=collator,
         num_workers=num_workers,
     )
 
@@ -107,3 +407,11 @@ if __name__ == "__main__":
     train_loader, val_loader = split_and_load(dataset, split_ratio=0.8)
     print("Train set size:", len(train_loader.dataset))
     print("Validation set size:", len(val_loader.dataset))
+
+    # Share of real tokens per training epoch, fixed-length vs dynamic padding
+    real = padded = 0
+    for batch in train_loader:
+        real += int(batch["attention_mask"].sum() + (batch["labels"] != -100).sum())
+        padded += batch["input_ids"].numel() + batch["labels"].numel()
+    fixed = len(train_loader.dataset) * (dataset.max_question_length + dataset.max_query_length)
+    print(f"Padding efficiency: fixed {real / fixed:.1%}, dynamic {real / padded:.1%}")
@@ -1,16 +1,36 @@
-from .PromptGenerator import generate_sql_prompt
-from .FlanT5 import FlanT5
-from .LLaMA2 import LLaMA2
-from .BaseModel import BaseModel
-from .SimpleAgent import SimpleAgent
-from .SpiderFRDataset import SpiderFRDataset, split_and_load
+import importlib
 
-__all__ = [
-    "generate_sql_prompt",
-    "FlanT5",
-    "LLaMA2",
-    "BaseModel",
-    "SimpleAgent",
-    "SpiderFRDataset",
-    "split_and_load",
-]
+# Submodules are imported on first access, so the prompt helpers stay usable
+# without loading torch or transformers
+_LAZY = {
+    "generate_sql_prompt": ".PromptGenerator",
+    "SQL_PROMPT_PREFIX": ".PromptGenerator",
+    "PrefixCache": ".PrefixCache",
+    "SQLPrefixValidator": ".SQLValidator",
+    "SQLConstrainedLogitsProcessor": ".SQLConstraint",
+    "FlanT5": ".FlanT5",
+    "LLaMA2": ".LLaMA2",
+    "BaseModel": ".BaseModel",
+    "SimpleAgent": ".SimpleAgent",
+    "SpiderFRDataset": ".SpiderFRDataset",
+    "split_and_load": ".SpiderFRDataset",
+    "DynamicPaddingCollator": ".SpiderFRDataset",
+    "LengthGroupedBatchSampler": ".SpiderFRDataset",
+    "CausalLMDataset": ".SpiderFRDataset",
+    "PackedCausalDataset": ".SpiderFRDataset",
+    "PackedCollator": ".SpiderFRDataset",
+}
+
+__all__ = list(_LAZY)
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
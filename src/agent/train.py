@@ -1,65 +1,126 @@
 from transformers import AutoModelForCausalLM, AutoTokenizer, TrainingArguments, Trainer
 from peft import prepare_model_for_kbit_training, LoraConfig, get_peft_model
 import torch
-from torch.utils.data import random_split
-from .SpiderFRDataset import SpiderFRDataset
-
-model_name = "meta-llama/Llama-2-7b-hf"  # Change as needed
-
-# Load model and tokenizer
-tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
-model = AutoModelForCausalLM.from_pretrained(
-    model_name,
-    device_map="auto",
-    load_in_4bit=True,
-    quantization_config={
-        "load_in_4bit": True,
-        "bnb_4bit_use_double_quant": True,
-        "bnb_4bit_quant_type": "nf4",
-        "bnb_4bit_compute_dtype": torch.bfloat16,
-    },
-)
-model = prepare_model_for_kbit_training(model)
-
-# LoRA config
-lora_config = LoraConfig(
-    r=8,
-    lora_alpha=16,
-    target_modules=["q_proj", "v_proj"],
-    lora_dropout=0.05,
-    bias="none",
-    task_type="CAUSAL_LM"
-)
-model = get_peft_model(model, lora_config)
-
-# Load and tokenize dataset
-full_dataset = SpiderFRDataset()
-
-# Split into train/validation subsets
-val_size = int(0.1 * len(full_dataset))
-train_size = len(full_dataset) - val_size
-train_dataset, val_dataset = random_split(full_dataset, [train_size, val_size])
-
-# Training
-training_args = TrainingArguments(
-    output_dir="./adapters",
-    per_device_train_batch_size=4,
-    gradient_accumulation_steps=4,
-    num_train_epochs=1,
-    learning_rate=2e-4,
-    fp16=True,
-    logging_dir="./logs",
-    save_total_limit=2,
-    save_steps=500,
+from torch.utils.data import DataLoader, random_split
+from .SpiderFRDataset import (
+    CausalLMDataset,
+    DynamicPaddingCollator,
+    LengthGroupedBatchSampler,
+    PackedCausalDataset,
+    PackedCollator,
+    SpiderFRDataset,
+    subset_lengths,
 )
 
-trainer = Trainer(
-    model=model,
-    args=training_args,
-    train_dataset=train_dataset,
-    eval_dataset=val_dataset,
-)
+MODEL_NAME = "meta-llama/Llama-2-7b-hf"  # Change as needed
+
+
+class LengthGroupedTrainer(Trainer):
+    """Trainer drawing its training batches from a :class:`LengthGroupedBatchSampler`."""
+
+    def get_train_dataloader(self) -> DataLoader:
+        sampler = LengthGroupedBatchSampler(
+            subset_lengths(self.train_dataset), self._train_batch_size, seed=self.args.seed
+        )
+        loader = DataLoader(
+            self.train_dataset,
+            batch_sampler=sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+        return self.accelerator.prepare(loader)
+
+
+def main(model_name: str = MODEL_NAME, packing: bool = False, seq_len: int = 512) -> None:
+    """Fine-tune *model_name* with LoRA on SpiderFR and save the adapters.
+
+    By default batches are length-grouped and padded dynamically. With
+    ``packing``, examples are packed into rows of ``seq_len`` tokens (see
+    :class:`PackedCausalDataset`), which needs the optional ``flash-attn``
+    package so flash-attention 2 keeps them apart.
+    """
+
+    # Load model and tokenizer
+    tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
+    model = AutoModelForCausalLM.from_pretrained(
+        model_name,
+        device_map="auto",
+        load_in_4bit=True,
+        quantization_config={
+            "load_in_4bit": True,
+            "bnb_4bit_use_double_quant": True,
+            "bnb_4bit_quant_type": "nf4",
+            "bnb_4bit_compute_dtype": torch.bfloat16,
+        },
+        **({"attn_implementation": "flash_attention_2"} if packing else {}),
+    )
+    model = prepare_model_for_kbit_training(model)
+
+    # LoRA config
+    lora_config = LoraConfig(
+        r=8,
+        lora_alpha=16,
+        target_modules=["q_proj", "v_proj"],
+        lora_dropout=0.05,
+        bias="none",
+        task_type="CAUSAL_LM"
+    )
+    model = get_peft_model(model, lora_config)
+
+    # Load and tokenize dataset with the model's own tokenizer
+    full_dataset = SpiderFRDataset(tokenizer_name=model_name)
+
+    # Split into train/validation subsets
+    val_size = int(0.1 * len(full_dataset))
+    train_size = len(full_dataset) - val_size
+    train_dataset, val_dataset = random_split(full_dataset, [train_size, val_size])
+    if packing:
+        train_dataset = PackedCausalDataset(train_dataset, seq_len)
+        val_dataset = PackedCausalDataset(val_dataset, seq_len)
+        print(f"Packed {train_size} examples into {len(train_dataset)} rows "
+              f"({train_dataset.efficiency():.1%} of tokens used)")
+    else:
+        # question + query sequences, padded per batch by the collator
+        train_dataset = CausalLMDataset(train_dataset, seq_len)
+        val_dataset = CausalLMDataset(val_dataset, seq_len)
+
+    # Training
+    training_args = TrainingArguments(
+        output_dir="./adapters",
+        per_device_train_batch_size=4,
+        gradient_accumulation_steps=4,
+        num_train_epochs=1,
+        learning_rate=2e-4,
+        fp16=True,
+        logging_dir="./logs",
+        save_total_limit=2,
+        save_steps=500,
+    )
+
+    if packing:
+        # Each batch of rows becomes one sequence, so flash-attention 2 keeps examples apart
+        trainer = Trainer(
+            model=model,
+            args=training_args,
+            train_dataset=train_dataset,
+            eval_dataset=val_dataset,
+            data_collator=PackedCollator(),
+        )
+    else:
+        trainer = LengthGroupedTrainer(
+            model=model,
+            args=training_args,
+            train_dataset=train_dataset,
+            eval_dataset=val_dataset,
+            # Pad each batch to its longest member; db_id is not a model input
+            data_collator=DynamicPaddingCollator(full_dataset.pad_token_id, keep_db_id=False),
+        )
+
+    trainer.train()
+    model.save_pretrained("./adapters")
+    tokenizer.save_pretrained("./adapters")
+
 
-trainer.train()
-model.save_pretrained("./adapters")
-tokenizer.save_pretrained("./adapters")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Compare DialogModule embedder backends on the Spider-FR dev questions.
+
+For each ``backend:schema_dtype`` configuration every dev question is linked
+with ``DialogModule.schema_link`` in normal mode, as the interactive demo
+does. The script reports:
+
+  * latency - mean and p95 milliseconds per question;
+  * recall@3 - share of the gold query's tables found among the first three
+    tables linked;
+  * agreement - overlap of the linked elements with the first configuration,
+    which should be the current backend (``torch:float32``).
+
+Dialog memories are written to a temporary directory, so the databases'
+``dialog_memory.txt`` files are left untouched.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Dict, List
+
+from DialogModule import DialogModule
+from SchemaIndex import flatten_schema, load_schemas
+
+DEFAULT_CONFIGS = ["torch:float32", "torch-int8:float32", "onnx:float32", "onnx-int8:int8", "torch:float16"]
+
+
+def gold_tables(query: str, schema: Dict[str, List[str]]) -> List[str]:
+    words = set(query.lower().replace(".", " ").replace(",", " ").split())
+    return [t for t in schema if t.lower() in words]
+
+
+def linked_tables(matches: List[dict], top_n: int = 3) -> List[str]:
+    tables: List[str] = []
+    for m in sorted(matches, key=lambda m: m["score"], reverse=True):
+        meta = m["schema_element"].split(" ")
+        table = meta[1] if len(meta) > 1 else meta[0]
+        if table not in tables:
+            tables.append(table)
+    return tables[:top_n]
+
+
+def run_config(config: str, records: List[dict], schemas: Dict[str, Dict[str, List[str]]], memory_dir: str) -> dict:
+    backend, schema_dtype = config.split(":")
+    dialogs: Dict[str, DialogModule] = {}
+    latencies, recalls, links = [], [], []
+    for i, rec in enumerate(records):
+        db_id = rec["db_id"]
+        if db_id not in dialogs:
+            dialogs[db_id] = DialogModule(
+                flatten_schema(schemas[db_id]),
+                os.path.join(memory_dir, config.replace(":", "_"), db_id, "dialog_memory.txt"),
+                mode="normal",
+                embed_backend=backend,
+                schema_dtype=schema_dtype,
+            )
+        start = time.perf_counter()
+        matches = dialogs[db_id].schema_link(rec["question"])
+        latencies.append(time.perf_counter() - start)
+
+        gold = gold_tables(rec["query"], schemas[db_id])
+        if gold:
+            found = linked_tables(matches)
+            recalls.append(sum(t in found for t in gold) / len(gold))
+        links.append({(m["keyword"], m["schema_element"]) for m in matches})
+
+    latencies.sort()
+    return {
+        "config": config,
+        "mean_ms": 1000 * sum(latencies) / len(latencies),
+        "p95_ms": 1000 * latencies[int(0.95 * (len(latencies) - 1))],
+        "recall@3": sum(recalls) / len(recalls) if recalls else 0.0,
+        "links": links,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Accuracy vs latency of DialogModule embedder backends")
+    parser.add_argument("--dataset", default="data/spider-fr/dev_spider.json", help="Spider-FR JSON dataset")
+    parser.add_argument(
+        "--db-root", default="databases/spider/test_database", help="Root directory of test databases"
+    )
+    parser.add_argument(
+        "--configs", nargs="+", default=DEFAULT_CONFIGS, help="backend:schema_dtype pairs, baseline first"
+    )
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N questions")
+    args = parser.parse_args()
+
+    with open(args.dataset, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    schemas = load_schemas(args.db_root)
+    records = [rec for rec in data if rec["db_id"] in schemas][: args.limit]
+    print(f"{len(records)} questions over {len({r['db_id'] for r in records})} databases")
+
+    with tempfile.TemporaryDirectory() as memory_dir:
+        results = [run_config(config, records, schemas, memory_dir) for config in args.configs]
+
+    baseline = results[0]["links"]
+    print(f"{'config':<22} {'mean ms':>8} {'p95 ms':>8} {'recall@3':>9} {'agreement':>10}")
+    for res in results:
+        overlaps = [len(a & b) / len(a | b) if a | b else 1.0 for a, b in zip(res["links"], baseline)]
+        agreement = sum(overlaps) / len(overlaps) if overlaps else 0.0
+        print(
+            f"{res['config']:<22} {res['mean_ms']:>8.1f} {res['p95_ms']:>8.1f} "
+            f"{res['recall@3']:>9.1%} {agreement:>10.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Training throughput with fixed-length vs dynamic padding.
+
+Runs the same number of forward/backward/optimizer steps of a causal LM
+over two loaders of the SpiderFR training examples (see
+:class:`agent.SpiderFRDataset.CausalLMDataset`):
+
+  * fixed   - shuffled batches padded to ``max_length``, as before;
+  * dynamic - length-grouped batches padded to their longest member.
+
+Both report real (non-padding) training tokens per second, so the numbers
+are directly comparable.
+"""
+
+import argparse
+import time
+
+import torch
+from torch.utils.data import DataLoader
+from transformers import AutoModelForCausalLM
+
+from agent.SpiderFRDataset import (
+    CausalLMDataset,
+    DynamicPaddingCollator,
+    LengthGroupedBatchSampler,
+    SpiderFRDataset,
+    subset_lengths,
+)
+
+
+def throughput(model, loader: DataLoader, steps: int, warmup: int = 2) -> dict:
+    """Time *steps* training steps after *warmup* untimed ones."""
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-5)
+    model.train()
+    real = padded = 0
+    elapsed = 0.0
+    batches = iter(loader)
+    for step in range(warmup + steps):
+        batch = next(batches)
+        batch = {k: v.to(model.device) for k, v in batch.items()}
+        if model.device.type == "cuda":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        loss = model(**batch).loss
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+        if model.device.type == "cuda":
+            torch.cuda.synchronize()
+        if step >= warmup:
+            elapsed += time.perf_counter() - start
+            real += int(batch["attention_mask"].sum())
+            padded += batch["input_ids"].numel()
+    return {"tokens_per_s": real / elapsed, "padding": 1 - real / padded, "seconds": elapsed}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Training tokens/s with fixed vs dynamic padding")
+    parser.add_argument("--model", default="Qwen/Qwen2.5-0.5B", help="Causal LM to train")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--max-length", type=int, default=384, help="Fixed padding length")
+    parser.add_argument("--steps", type=int, default=20, help="Timed steps per loader")
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = AutoModelForCausalLM.from_pretrained(args.model).to(device)
+    dataset = CausalLMDataset(SpiderFRDataset(tokenizer_name=args.model), args.max_length)
+    generator = torch.Generator().manual_seed(0)
+
+    fixed = DataLoader(
+        dataset,
+        batch_size=args.batch_size,
+        shuffle=True,
+        generator=generator,
+        # Every batch is padded up to max_length
+        collate_fn=DynamicPaddingCollator(dataset.pad_token_id, pad_to_multiple_of=args.max_length),
+    )
+    dynamic = DataLoader(
+        dataset,
+        batch_sampler=LengthGroupedBatchSampler(subset_lengths(dataset), args.batch_size),
+        collate_fn=DynamicPaddingCollator(dataset.pad_token_id),
+    )
+
+    print(f"{args.model} on {device}, batch size {args.batch_size}, {args.steps} steps")
+    print(f"{'padding':<8} {'tokens/s':>10} {'padding share':>14}")
+    results = {}
+    for name, loader in (("fixed", fixed), ("dynamic", dynamic)):
+        results[name] = throughput(model, loader, args.steps)
+        res = results[name]
+        print(f"{name:<8} {res['tokens_per_s']:>10.1f} {res['padding']:>14.1%}")
+    print(f"speedup: {results['dynamic']['tokens_per_s'] / results['fixed']['tokens_per_s']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
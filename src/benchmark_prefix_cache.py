@@ -0,0 +1,89 @@
+"""Measure the time to first token (TTFT) with and without the prompt prefix cache.
+
+The same SQL generation prompts are run through a decoder-only model on CPU,
+once re-encoding the whole prompt and once through :class:`PrefixCache`.
+TTFT is timed as a ``generate`` call with ``max_new_tokens=1``. The script
+also checks that greedy completions are identical on both paths.
+"""
+
+import argparse
+import statistics
+import time
+from typing import Callable, List
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from agent.PrefixCache import PrefixCache
+from agent.PromptGenerator import SQL_PROMPT_PREFIX, generate_sql_prompt
+
+SCHEMA = {
+    "tables": [
+        {"name": "singer", "columns": ["singer_id", "name", "country", "age"]},
+        {"name": "concert", "columns": ["concert_id", "concert_name", "stadium_id", "year"]},
+        {"name": "singer_in_concert", "columns": ["concert_id", "singer_id"]},
+    ]
+}
+
+QUESTIONS = [
+    "Combien de chanteurs avons-nous ?",
+    "Quels sont les noms des chanteurs de France ?",
+    "Quel est l'âge moyen des chanteurs ?",
+    "Combien de concerts ont eu lieu en 2014 ?",
+]
+
+
+def time_ms(func: Callable[[], object], runs: int) -> float:
+    """Median wall time of *func* in milliseconds, after one warm-up call."""
+    func()
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        samples.append(1000 * (time.perf_counter() - start))
+    return statistics.median(samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="TTFT with and without the prefix cache")
+    parser.add_argument("--model", default="Qwen/Qwen2.5-0.5B-Instruct", help="Decoder-only model")
+    parser.add_argument("--runs", type=int, default=5, help="Timed runs per prompt")
+    parser.add_argument("--threads", type=int, default=None, help="torch CPU threads")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForCausalLM.from_pretrained(args.model).to("cpu").eval()
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    cache = PrefixCache(model, tokenizer, SQL_PROMPT_PREFIX)
+
+    prompts: List[str] = [generate_sql_prompt(SCHEMA, q, db_type="sqlite") for q in QUESTIONS]
+    if not cache.covers(prompts):
+        raise SystemExit("The prompts do not tokenize to the cached prefix IDs for this tokenizer.")
+
+    def uncached(prompt: str, max_new_tokens: int) -> str:
+        inputs = tokenizer(prompt, return_tensors="pt")
+        with torch.no_grad():
+            out = model.generate(
+                **inputs, max_new_tokens=max_new_tokens, do_sample=False, pad_token_id=tokenizer.pad_token_id
+            )
+        return tokenizer.decode(out[0, inputs.input_ids.shape[1]:], skip_special_tokens=True).strip()
+
+    def cached(prompt: str, max_new_tokens: int) -> str:
+        return cache.generate([prompt], max_new_tokens=max_new_tokens, do_sample=False)[0]
+
+    prefix_tokens = cache.prefix_ids.shape[1]
+    print(f"{args.model}: prefix of {prefix_tokens} tokens, {torch.get_num_threads()} threads")
+    print(f"{'prompt tokens':>13} {'uncached ms':>12} {'cached ms':>10} {'speedup':>8} {'same SQL':>9}")
+    for prompt in prompts:
+        full = time_ms(lambda: uncached(prompt, 1), args.runs)
+        reuse = time_ms(lambda: cached(prompt, 1), args.runs)
+        same = uncached(prompt, 32) == cached(prompt, 32)
+        n_tokens = len(tokenizer(prompt).input_ids)
+        print(f"{n_tokens:>13} {full:>12.1f} {reuse:>10.1f} {full / reuse:>7.1f}x {str(same):>9}")
+
+
+if __name__ == "__main__":
+    main()
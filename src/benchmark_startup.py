@@ -0,0 +1,68 @@
+"""Measure interpreter startup time of the package's entry points.
+
+Each case runs in a fresh ``python`` process from the repository root, so
+nothing is cached between runs; the best of ``--runs`` wall times is
+reported. ``import src`` must stay well under a second because the package
+exports (see ``src/__init__.py``) are only imported on first access. The
+remaining cases touch those exports, so a broken lazy import shows up as a
+failure instead of a time.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+from typing import List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = [
+    ("import src", "import src"),
+    ("src.DBManager", "import src; src.DBManager"),
+    ("src.ModelRegistry", "import src; src.ModelRegistry; src.get_registry"),
+    ("src.agent prompts", "import src; src.agent.generate_sql_prompt"),
+    ("src.DialogModule", "import src; src.DialogModule"),
+    ("src.populate_dialog_memory", "import src; src.populate_dialog_memory"),
+    ("src.evaluation", "import src; src.evaluation"),
+    # What `python src/DBManager.py` loads before opening its database
+    ("DBManager script", "import sys; sys.path.insert(0, 'src'); import DBManager"),
+]
+
+
+def time_case(code: str, runs: int) -> Tuple[Optional[float], str]:
+    """Best wall time of ``python -c code``, or None and the error's last line."""
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+        elapsed = time.perf_counter() - start
+        if proc.returncode:
+            lines = proc.stderr.strip().splitlines()
+            return None, lines[-1] if lines else f"exit code {proc.returncode}"
+        best = elapsed if best is None else min(best, elapsed)
+    return best, ""
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Startup time of the FR2SQL entry points")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per case")
+    args = parser.parse_args()
+
+    baseline, _ = time_case("pass", args.runs)
+    print(f"bare interpreter: {baseline:.3f} s (best of {args.runs})")
+    print(f"{'case':<28} {'seconds':>8}")
+    failures: List[str] = []
+    for name, code in CASES:
+        seconds, error = time_case(code, args.runs)
+        if seconds is None:
+            failures.append(name)
+            print(f"{name:<28} {'failed':>8}  {error}")
+        else:
+            print(f"{name:<28} {seconds:>8.3f}")
+    if failures:
+        print(f"{len(failures)} case(s) failed, see the errors above.")
+
+
+if __name__ == "__main__":
+    main()
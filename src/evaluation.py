@@ -3,22 +3,26 @@ import os
 from typing import List, Dict
 import subprocess
 import sys
+import time
 
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from tqdm import tqdm
+from transformers import AutoModelForCausalLM, AutoTokenizer, LogitsProcessorList
 
 from DialogModule import DialogModule
-from agent.PromptGenerator import generate_sql_prompt
-from spider.process_sql import tokenize
+from ResultCache import normalize_sql as normalize_tokens
+from agent.PrefixCache import PrefixCache
+from agent.PromptGenerator import SQL_PROMPT_PREFIX, generate_sql_prompt, link_scores
+from agent.SQLConstraint import SQLConstrainedLogitsProcessor, SQLPrefixValidator
 
 MODEL_DIR = "./adapters"
 DB_ROOT = "databases/spider/test_database"
+MAX_NEW_TOKENS = 128
 
 
 def normalize_sql(sql: str) -> str:
-    """Normalize SQL string by tokenizing and joining tokens."""
-    tokens = tokenize(sql)
-    return " ".join(tokens)
+    """Normalize SQL with the Spider tokenizer; either quote character matches."""
+    return normalize_tokens(sql, keep_quotes=False)
 
 
 def load_schema(db_id: str, db_root: str) -> Dict[str, List[str]]:
@@ -44,10 +48,20 @@ def build_dialog(schema: Dict[str, List[str]]) -> DialogModule:
     return DialogModule(schema_elements)
 
 
-def generate_sql(
-    question: str, schema: Dict[str, List[str]], dialog: DialogModule, model, tokenizer
+def build_prompt(
+    question: str,
+    schema: Dict[str, List[str]],
+    dialog: DialogModule,
+    tokenizer=None,
+    matches: List[dict] | None = None,
 ) -> str:
-    matches = dialog.schema_link(question)
+    """Link *question* to the schema and return the generation prompt.
+
+    With a ``tokenizer`` the least relevant columns are pruned to fit its
+    maximum length. Precomputed ``matches`` skip the linking step.
+    """
+    if matches is None:
+        matches = dialog.schema_link(question)
     matches.sort(key=lambda m: m["score"], reverse=True)
 
     selected_tables = []
@@ -65,16 +79,85 @@ def generate_sql(
         if t in schema:
             schema_for_prompt["tables"].append({"name": t, "columns": schema[t]})
 
-    prompt = generate_sql_prompt(schema_for_prompt, question, db_type="sqlite")
-    inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
+    return generate_sql_prompt(
+        schema_for_prompt,
+        question,
+        db_type="sqlite",
+        tokenizer=tokenizer,
+        scores=link_scores(matches),
+        # The completion shares the causal LM's context with the prompt
+        reserve_tokens=MAX_NEW_TOKENS,
+    )
+
+
+def generate_sql_batch(
+    prompts: List[str],
+    model,
+    tokenizer,
+    prefix_cache: PrefixCache | None = None,
+    validators: List[SQLPrefixValidator] | None = None,
+) -> List[str]:
+    """Generate SQL for several prompts with a single padded ``generate`` call.
+
+    With a ``prefix_cache`` the shared prompt preamble is not re-encoded.
+    With ``validators`` (one per prompt) decoding is constrained to valid SQL.
+    """
+    constraint = {}
+    if validators:
+        constraint["logits_processor"] = LogitsProcessorList(
+            [SQLConstrainedLogitsProcessor(tokenizer, validators)]
+        )
+    if prefix_cache is not None and prefix_cache.covers(prompts):
+        return prefix_cache.generate(
+            prompts,
+            max_new_tokens=MAX_NEW_TOKENS,
+            do_sample=False,
+            num_beams=1,
+            **constraint,
+        )
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    # Decoder-only models continue from the last position, so pad on the left.
+    tokenizer.padding_side = "left"
+    inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(model.device)
     with torch.no_grad():
         outputs = model.generate(
             **inputs,
-            max_new_tokens=128,
+            max_new_tokens=MAX_NEW_TOKENS,
             do_sample=False,
             num_beams=1,
+            pad_token_id=tokenizer.pad_token_id,
+            **constraint,
         )
-    return tokenizer.decode(outputs[0], skip_special_tokens=True).strip()
+    # Causal LM rows are the (left-padded) prompt followed by the completion
+    completions = outputs[:, inputs.input_ids.shape[1]:]
+    return [
+        tokenizer.decode(out, skip_special_tokens=True).strip() for out in completions
+    ]
+
+
+def generate_sql(
+    question: str,
+    schema: Dict[str, List[str]],
+    dialog: DialogModule,
+    model,
+    tokenizer,
+    prefix_cache: PrefixCache | None = None,
+    validator: SQLPrefixValidator | None = None,
+) -> str:
+    prompt = build_prompt(question, schema, dialog, tokenizer)
+    validators = [validator] if validator else None
+    return generate_sql_batch([prompt], model, tokenizer, prefix_cache, validators)[0]
+
+
+def length_buckets(lengths: List[int], batch_size: int) -> List[List[int]]:
+    """Group indices into batches of similar length to limit padding waste.
+
+    Indices are sorted by ``lengths`` (longest first so an out-of-memory error
+    surfaces on the first batch) and then sliced into chunks of ``batch_size``.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    return [order[i : i + batch_size] for i in range(0, len(order), batch_size)]
 
 
 def run_test_suite_eval(
@@ -121,6 +204,9 @@ def evaluate_dataset(
     pred_file: str = "pred.txt",
     label_file: str = "labels.txt",
     result_file: str = "eval_result.txt",
+    batch_size: int = 1,
+    prefix_cache: bool = False,
+    constrained: bool = False,
 ) -> float:
     """Evaluate the model on a Spider‑FR style dataset.
 
@@ -129,42 +215,61 @@ def evaluate_dataset(
       * ``pred_file`` – predicted SQL queries in the same order.
       * ``result_file`` – summary of the evaluation (currently the exact match
         accuracy).
+
+    With ``batch_size`` greater than one, prompts are grouped into padded
+    batches of similar token length; predictions keep the dataset order.
+    ``prefix_cache`` reuses the key/value cache of the static prompt preamble
+    and ``constrained`` restricts decoding to SQL valid for each database.
     """
     with open(dataset_path, "r", encoding="utf-8") as f:
         data = json.load(f)
 
     tokenizer = AutoTokenizer.from_pretrained(model_dir)
     model = AutoModelForCausalLM.from_pretrained(model_dir, device_map="auto")
+    cache = PrefixCache(model, tokenizer, SQL_PROMPT_PREFIX) if prefix_cache else None
 
     schema_cache: Dict[str, Dict[str, List[str]]] = {}
-    dialog_cache: Dict[str, DialogModule] = {}
+    validator_cache: Dict[str, SQLPrefixValidator] = {}
 
     total = len(data)
     correct = 0
-    predictions: List[str] = []
-    labels: List[str] = []
-
-    for rec in data:
-        question = rec["question"]
-        expected = rec["query"]
-        db_id = rec["db_id"]
-
-        if db_id not in schema_cache:
-            schema_cache[db_id] = load_schema(db_id, db_root)
-            dialog_cache[db_id] = build_dialog(schema_cache[db_id])
-
-        schema = schema_cache[db_id]
-        dialog = dialog_cache[db_id]
-        predicted = generate_sql(question, schema, dialog, model, tokenizer)
-
-        predictions.append(predicted)
-        labels.append(expected)
+    prompts: List[str] = [""] * total
+    labels: List[str] = [rec["query"] for rec in data]
+
+    # Questions of a database are linked together in one batch
+    by_db: Dict[str, List[int]] = {}
+    for i, rec in enumerate(data):
+        by_db.setdefault(rec["db_id"], []).append(i)
+
+    for db_id, indices in tqdm(by_db.items(), desc="Linking"):
+        schema_cache[db_id] = load_schema(db_id, db_root)
+        validator_cache[db_id] = SQLPrefixValidator(schema_cache[db_id])
+        dialog = build_dialog(schema_cache[db_id])
+        questions = [data[i]["question"] for i in indices]
+        for i, matches in zip(indices, dialog.schema_link_batch(questions)):
+            prompts[i] = build_prompt(data[i]["question"], schema_cache[db_id], dialog, tokenizer, matches)
+
+    lengths = [len(ids) for ids in tokenizer(prompts).input_ids] if prompts else []
+    predictions: List[str] = [""] * total
+
+    start = time.perf_counter()
+    for batch in tqdm(length_buckets(lengths, max(batch_size, 1)), desc="Generating"):
+        validators = [validator_cache[data[i]["db_id"]] for i in batch] if constrained else None
+        outputs = generate_sql_batch(
+            [prompts[i] for i in batch], model, tokenizer, cache, validators
+        )
+        for i, predicted in zip(batch, outputs):
+            predictions[i] = predicted
+    elapsed = time.perf_counter() - start
+    throughput = total / elapsed if elapsed > 0 else 0.0
 
+    for predicted, expected in zip(predictions, labels):
         if normalize_sql(predicted) == normalize_sql(expected):
             correct += 1
 
     accuracy = correct / total if total else 0.0
     result_line = f"Exact match accuracy: {accuracy:.2%} ({correct}/{total})"
+    throughput_line = f"Throughput: {throughput:.2f} records/s (batch size {batch_size})"
 
     # Write artefacts
     with open(pred_file, "w", encoding="utf-8") as pf:
@@ -173,8 +278,10 @@ def evaluate_dataset(
         lf.write("\n".join(labels))
     with open(result_file, "w", encoding="utf-8") as rf:
         rf.write(result_line + "\n")
+        rf.write(throughput_line + "\n")
 
     print(result_line)
+    print(throughput_line)
 
     # Run the official test suite evaluation if available
     run_test_suite_eval(label_file, pred_file, db_root)
@@ -202,6 +309,22 @@ if __name__ == "__main__":
         default="eval_result.txt",
         help="File to write evaluation result",
     )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="Number of prompts generated per model call",
+    )
+    parser.add_argument(
+        "--prefix-cache",
+        action="store_true",
+        help="Reuse the key/value cache of the static prompt preamble",
+    )
+    parser.add_argument(
+        "--constrained",
+        action="store_true",
+        help="Constrain decoding to SQL valid for each database",
+    )
     args = parser.parse_args()
 
     evaluate_dataset(
@@ -211,4 +334,7 @@ if __name__ == "__main__":
         pred_file=args.pred_file,
         label_file=args.label_file,
         result_file=args.result_file,
+        batch_size=args.batch_size,
+        prefix_cache=args.prefix_cache,
+        constrained=args.constrained,
     )
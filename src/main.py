@@ -9,8 +9,10 @@ import pyperclip
 
 from DBManager import DBManager
 from DialogModule import DialogModule
-from agent.PromptGenerator import generate_sql_prompt
-from agent import SimpleAgent
+from SemanticCache import SemanticCache
+from SchemaIndex import SchemaIndex, flatten_schema
+from agent.PromptGenerator import generate_sql_prompt, link_scores
+from agent import SimpleAgent, SQLPrefixValidator
 
 # Base path where Spider test databases are stored
 DB_BASE_PATH = "databases/spider/test_database"
@@ -20,6 +22,19 @@ DB_BASE_PATH = "databases/spider/test_database"
 # the linker which filters individual matches.
 CONFIDENCE_THRESHOLD = 80
 
+# Minimum cosine similarity for reusing the SQL of a previous question
+SEMANTIC_CACHE_THRESHOLD = 0.92
+
+# Number of result rows printed before asking whether to fetch more
+PAGE_SIZE = 20
+
+# Guardrails for generated or pasted SQL (see DBManager)
+QUERY_TIMEOUT = 10.0
+QUERY_MAX_STEPS = 50_000_000
+# Results are paged lazily, so a plain scan only reads the rows shown; only
+# much larger scans and cross joins are refused before running
+QUERY_MAX_SCAN_ROWS = 10_000_000
+
 def compute_average(scores: List[float]) -> float:
     return sum(scores) / len(scores) if scores else 0.0
 
@@ -35,76 +50,126 @@ def main() -> None:
         return
 
 
-    db_id = input("Enter the database ID [aircraft]: ").strip() or 'aircraft'
+    first_question = None
+    db_id = input("Enter the database ID [aircraft, '?' to find it from your question]: ").strip() or 'aircraft'
+    if db_id == "?":
+        # Route the first question over every database's schema
+        index = SchemaIndex.from_directory(DB_BASE_PATH)
+        first_question = input("Question: ").strip()
+        routes = index.route(first_question, k=3)
+        for rank, route in enumerate(routes, 1):
+            print(f"{rank}. {route['db_id']} ({route['score']:.2f})")
+        while True:
+            choice = input("Pick a database [1]: ").strip() or "1"
+            if not choice.isdigit():
+                db_id = choice  # a database ID typed directly
+                break
+            if 1 <= int(choice) <= len(routes):
+                db_id = routes[int(choice) - 1]["db_id"]
+                break
+            print(f"Enter a number between 1 and {len(routes)}, or a database ID.")
     db_path = os.path.join(DB_BASE_PATH, db_id, f"{db_id}.sqlite")
     if not os.path.exists(db_path):
         print(f"Database '{db_path}' not found.")
         return
-    db = DBManager(db_path)
+    db = DBManager(
+        db_path,
+        timeout=QUERY_TIMEOUT,
+        max_steps=QUERY_MAX_STEPS,
+        explain_check=True,
+        max_scan_rows=QUERY_MAX_SCAN_ROWS,
+    )
     schema_pairs: Dict[str, List[str]] = db.extract_column_table_pairs()
+    # Keeps the agent's decoding to valid SQL over this database's names
+    validator = SQLPrefixValidator(schema_pairs)
 
     # Flatten table and column names for the linker
-    schema_elements: List[str] = list(schema_pairs.keys()) + [
-        f"{col} {table}" for table, cols in schema_pairs.items() for col in cols
-    ]
+    schema_elements: List[str] = flatten_schema(schema_pairs)
 
     # File storing past user questions for the DialogModule
     mem = os.path.join(db_path.rsplit("\\",1)[0], "dialog_memory.txt")
     dialog = DialogModule(schema_elements, mem, mode='normal')
 
+    # Accepted SQL of previous questions, matched by question embedding
+    semantic_cache = None
+    if hasattr(dialog, "embedder"):
+        semantic_cache = SemanticCache(
+            os.path.join(os.path.dirname(db_path), "semantic_cache.json"),
+            dialog.embedder,
+            schema_elements,
+            threshold=SEMANTIC_CACHE_THRESHOLD,
+        )
+
     while True:
         # Ask the user for a new question
-        question = dialog.ask(prefix="Question (type 'exit' to quit): ")
+        question = first_question or dialog.ask(prefix="Question (type 'exit' to quit): ")
+        first_question = None
         if question.lower() in {"exit", "quit"}:
             break
 
-        # Link the user's request to the database schema
-        matches = dialog.schema_link(question)
-        matches.sort(key=lambda m: m["score"], reverse=True)
-
-        selected = []
-        selected_tables = []
-        for m in matches:
-            meta = m["schema_element"].split(" ")
-            if len(meta) > 1:
-                m["schema_table"] = meta[1]
-                m["schema_column"] = meta[0]
-            else:
-                m["schema_table"] = meta[0]
-            if m["schema_table"] not in selected_tables and m["score"] > CONFIDENCE_THRESHOLD:
-                selected.append(m)
-                selected_tables.append(m["schema_table"])
-                print(f"Matched: '{m['keyword']}' → '{m['schema_table']}.{m.get('schema_column', '')}' ({m['score']}%)")
-
-        avg_score = compute_average([m["score"] for m in selected])
-
-        if avg_score < CONFIDENCE_THRESHOLD:
-            # Confidence too low → ask for clarification
-            question += " " + dialog.ask(prompt="Could you clarify your question?", prefix="Clarification: ")
-
-        # Determine which tables were referenced
-        table_metadata = {t: db.extract_table_metadata(t) for t in selected_tables}
-
-        schema_for_prompt = {"tables": []}
-        for t, meta in table_metadata.items():
-            schema_for_prompt["tables"].append({
-                "name": t,
-                "columns": meta["columns"],
-            })
-
-        prompt = generate_sql_prompt(schema_for_prompt, question)
-        pyperclip.copy(prompt)
-        print("Prompt copied to clipboard.")
-
-        if agent:
-            try:
-                generated_sql = agent.generate(prompt)
-                if not generated_sql.strip().endswith(";"): generated_sql += ";"
-                print("Agent : " + generated_sql + "\n")
-            except Exception as exc:
-                print(f"Error generating SQL: {exc}")
-                continue
-        extra = "Press Enter to run the generated query or paste another SQL:\n" if agent else "Enter your SQL query:\n"
+        generated_sql = ""
+        cached = semantic_cache.lookup(question) if semantic_cache else None
+        if cached:
+            # A paraphrase was already answered: skip linking and generation
+            generated_sql = cached["sql"]
+            print(f"Cached answer for '{cached['question']}' ({cached['score']:.0%}): {generated_sql}\n")
+        else:
+            # Link the user's request to the database schema
+            matches = dialog.schema_link(question)
+            matches.sort(key=lambda m: m["score"], reverse=True)
+
+            selected = []
+            selected_tables = []
+            for m in matches:
+                meta = m["schema_element"].split(" ")
+                if len(meta) > 1:
+                    m["schema_table"] = meta[1]
+                    m["schema_column"] = meta[0]
+                else:
+                    m["schema_table"] = meta[0]
+                if m["schema_table"] not in selected_tables and m["score"] > CONFIDENCE_THRESHOLD:
+                    selected.append(m)
+                    selected_tables.append(m["schema_table"])
+                    print(f"Matched: '{m['keyword']}' → '{m['schema_table']}.{m.get('schema_column', '')}' ({m['score']}%)")
+
+            avg_score = compute_average([m["score"] for m in selected])
+
+            if avg_score < CONFIDENCE_THRESHOLD:
+                # Confidence too low → ask for clarification
+                question += " " + dialog.ask(prompt="Could you clarify your question?", prefix="Clarification: ")
+
+            # Determine which tables were referenced (served from the cached catalog)
+            catalog = db.schema_catalog()
+            table_metadata = {t: catalog[t] for t in selected_tables if t in catalog}
+
+            schema_for_prompt = {"tables": []}
+            for t, meta in table_metadata.items():
+                schema_for_prompt["tables"].append({
+                    "name": t,
+                    "columns": meta["columns"],
+                    "foreign_keys": meta["foreign_keys"],
+                })
+
+            # Prune the least relevant columns so the prompt fits the agent's context
+            prompt = generate_sql_prompt(
+                schema_for_prompt,
+                question,
+                tokenizer=agent.tokenizer if agent else None,
+                scores=link_scores(matches),
+                reserve_tokens=getattr(agent, "prompt_reserve", 0),
+            )
+            pyperclip.copy(prompt)
+            print("Prompt copied to clipboard.")
+
+            if agent:
+                try:
+                    generated_sql = agent.generate(prompt, validator=validator)
+                    if not generated_sql.strip().endswith(";"): generated_sql += ";"
+                    print("Agent : " + generated_sql + "\n")
+                except Exception as exc:
+                    print(f"Error generating SQL: {exc}")
+                    continue
+        extra = "Press Enter to run the generated query or paste another SQL:\n" if generated_sql else "Enter your SQL query:\n"
         user_sql = input(extra + "SQL> ").strip()
         if not user_sql: user_sql = generated_sql or ""
 
@@ -113,19 +178,29 @@ def main() -> None:
             print("Invalid or incomplete SQL statement.")
         else:
             try:
-                result = db.execute_query(user_sql)
+                result = db.stream_query(user_sql, chunk_size=PAGE_SIZE, allow_write=True)
                 if "columns" in result:
                     clean_cols = [col.replace("_", " ") for col in result["columns"]]
                     header = " | ".join(clean_cols)
                     print(header)
                     print("-" * len(header))
-                    for row in result["rows"]:
-                        print(" | ".join(str(v) for v in row))
+                    # Each page is only fetched once the user asks for it
+                    for chunk in result["chunks"]:
+                        for row in chunk:
+                            print(" | ".join(str(v) for v in row))
+                        if len(chunk) < PAGE_SIZE:
+                            break
+                        if input("-- Enter for more rows, 'q' to stop: ").strip().lower() == "q":
+                            break
+                    if semantic_cache:
+                        semantic_cache.add(question, user_sql)
                 else:
                     print(f"Rows affected: {result['rowcount']}")
             except Exception as exc:
                 print(f"Error executing query: {exc}")
 
+    if semantic_cache:
+        semantic_cache.close()
     db.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,370 @@
+"""Local asyncio HTTP service running the FR2SQL pipeline.
+
+``POST /query`` with ``{"db_id": ..., "question": ..., "execute": true}``
+links the question to the schema, builds the prompt, generates SQL and
+optionally runs it. Prompts from concurrent requests are grouped by a
+dynamic batcher into one constrained ``generate_batch`` call; linking and SQLite
+execution run on thread pools so the event loop stays responsive.
+``GET /metrics`` reports per-stage latencies and ``GET /health`` liveness.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Tuple
+
+from DBManager import DBManager
+from DialogModule import DialogModule
+from SchemaIndex import SchemaIndex, flatten_schema
+from agent.PromptGenerator import generate_sql_prompt, link_scores
+from agent.SQLConstraint import SQLPrefixValidator
+
+DB_BASE_PATH = "databases/spider/test_database"
+
+# Same linking threshold as the interactive demo in main.py
+CONFIDENCE_THRESHOLD = 80
+
+# Maximum number of rows returned for an executed query
+ROW_LIMIT = 100
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+
+
+class StageMetrics:
+    """Latency statistics per pipeline stage over a sliding window."""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, int] = {}
+        self._totals: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+            self._counts[stage] = self._counts.get(stage, 0) + 1
+            self._totals[stage] = self._totals.get(stage, 0.0) + seconds
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            stats = {}
+            for stage, samples in self._samples.items():
+                ordered = sorted(samples)
+                stats[stage] = {
+                    "count": self._counts[stage],
+                    "mean_ms": 1000 * self._totals[stage] / self._counts[stage],
+                    "p50_ms": 1000 * ordered[len(ordered) // 2],
+                    "p95_ms": 1000 * ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                    "max_ms": 1000 * ordered[-1],
+                }
+            return stats
+
+
+class DynamicBatcher:
+    """Collect prompts for up to ``max_wait_ms`` and generate them together.
+
+    A batch is flushed as soon as it holds ``max_batch_size`` prompts or the
+    wait expires. Requests arriving while a batch is generating queue up for
+    the next one. Generation runs on a single worker thread.
+    """
+
+    def __init__(
+        self,
+        generate_batch: Callable[[List[str], List[SQLPrefixValidator]], List[str]],
+        metrics: StageMetrics,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 5.0,
+    ):
+        self.generate_batch = generate_batch
+        self.metrics = metrics
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.batches = 0
+        self.requests = 0
+        self._queue: "asyncio.Queue[Tuple[str, SQLPrefixValidator, asyncio.Future]]" = None
+        self._task: asyncio.Task = None
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, prompt: str, validator: SQLPrefixValidator) -> str:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((prompt, validator, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            start = time.perf_counter()
+            try:
+                outputs = await loop.run_in_executor(
+                    self.executor,
+                    self.generate_batch,
+                    [prompt for prompt, _, _ in batch],
+                    [validator for _, validator, _ in batch],
+                )
+            except Exception as exc:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            self.metrics.record("generate_batch", time.perf_counter() - start)
+            self.batches += 1
+            self.requests += len(batch)
+            for (_, _, future), output in zip(batch, outputs):
+                if not future.done():
+                    future.set_result(output)
+
+
+class FR2SQLService:
+    """Pipeline state shared by every request: agent, per-database linkers and pools."""
+
+    def __init__(
+        self,
+        agent: Any,
+        db_root: str = DB_BASE_PATH,
+        mode: str = "normal",
+        max_batch_size: int = 8,
+        max_wait_ms: float = 5.0,
+        link_workers: int = 4,
+        db_workers: int = 4,
+    ):
+        self.db_root = db_root
+        self.mode = mode
+        self.metrics = StageMetrics()
+        self.tokenizer = getattr(agent, "tokenizer", None)
+        self.reserve_tokens = getattr(agent, "prompt_reserve", 0)
+        self.batcher = DynamicBatcher(agent.generate_batch, self.metrics, max_batch_size, max_wait_ms)
+        self.link_pool = ThreadPoolExecutor(max_workers=link_workers, thread_name_prefix="link")
+        self.db_pool = ThreadPoolExecutor(max_workers=db_workers, thread_name_prefix="sqlite")
+        self._contexts: Dict[str, Tuple[DBManager, DialogModule, threading.Lock, SQLPrefixValidator]] = {}
+        self._contexts_lock = threading.Lock()
+        self._index = None
+        self._index_lock = threading.Lock()
+
+    def _route(self, question: str, k: int = 3) -> List[dict]:
+        """Rank databases for a question sent without ``db_id`` (runs on the link pool)."""
+        start = time.perf_counter()
+        with self._index_lock:
+            if self._index is None:
+                self._index = SchemaIndex.from_directory(self.db_root)
+        routes = self._index.route(question, k=k)
+        self.metrics.record("route", time.perf_counter() - start)
+        return routes
+
+    def _context(self, db_id: str) -> Tuple[DBManager, DialogModule, threading.Lock, SQLPrefixValidator]:
+        with self._contexts_lock:
+            if db_id not in self._contexts:
+                db_dir = os.path.join(self.db_root, db_id)
+                db_path = os.path.join(db_dir, f"{db_id}.sqlite")
+                if not os.path.exists(db_path):
+                    raise FileNotFoundError(f"Database '{db_id}' not found.")
+                db = DBManager(db_path, pool=True, timeout=10.0, explain_check=True)
+                schema_pairs = db.extract_column_table_pairs()
+                schema_elements = flatten_schema(schema_pairs)
+                dialog = DialogModule(
+                    schema_elements, os.path.join(db_dir, "dialog_memory.txt"), mode=self.mode
+                )
+                # DialogModule updates its memory, so linking is serialized per database
+                self._contexts[db_id] = (db, dialog, threading.Lock(), SQLPrefixValidator(schema_pairs))
+            return self._contexts[db_id]
+
+    def _link(self, db_id: str, question: str) -> Tuple[str, List[dict], SQLPrefixValidator]:
+        """Link *question* to the schema and build its prompt (runs on the link pool)."""
+        start = time.perf_counter()
+        db, dialog, lock, validator = self._context(db_id)
+        with lock:
+            matches = dialog.schema_link(question)
+        matches.sort(key=lambda m: m["score"], reverse=True)
+        selected_tables: List[str] = []
+        links = []
+        for m in matches:
+            meta = m["schema_element"].split(" ")
+            table = meta[1] if len(meta) > 1 else meta[0]
+            if table not in selected_tables and m["score"] > CONFIDENCE_THRESHOLD:
+                selected_tables.append(table)
+                links.append({k: m[k] for k in ("keyword", "schema_element", "score")})
+        self.metrics.record("link", time.perf_counter() - start)
+
+        start = time.perf_counter()
+        catalog = db.schema_catalog()
+        schema_for_prompt = {
+            "tables": [
+                {
+                    "name": t,
+                    "columns": catalog[t]["columns"],
+                    "foreign_keys": catalog[t]["foreign_keys"],
+                }
+                for t in selected_tables
+                if t in catalog
+            ]
+        }
+        prompt = generate_sql_prompt(
+            schema_for_prompt,
+            question,
+            tokenizer=self.tokenizer,
+            scores=link_scores(matches),
+            reserve_tokens=self.reserve_tokens,
+        )
+        self.metrics.record("prompt", time.perf_counter() - start)
+        return prompt, links, validator
+
+    def _execute(self, db_id: str, sql: str) -> Dict[str, Any]:
+        start = time.perf_counter()
+        db = self._context(db_id)[0]
+        try:
+            # Constrained decoding can fall back to unconstrained output, so
+            # only read statements run, and never on the writer connection
+            return db.execute_query(sql, limit=ROW_LIMIT, read_only=True)
+        finally:
+            self.metrics.record("execute", time.perf_counter() - start)
+
+    async def handle_query(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        question = payload["question"].strip()
+        db_id, routes = payload.get("db_id"), None
+        if not db_id:
+            routes = await loop.run_in_executor(self.link_pool, self._route, question)
+            db_id = routes[0]["db_id"]
+
+        prompt, links, validator = await loop.run_in_executor(self.link_pool, self._link, db_id, question)
+
+        generate_start = time.perf_counter()
+        sql = await self.batcher.submit(prompt, validator)
+        self.metrics.record("generate", time.perf_counter() - generate_start)
+        if not sql.strip().endswith(";"):
+            sql += ";"
+
+        response: Dict[str, Any] = {"db_id": db_id, "question": question, "links": links, "sql": sql}
+        if routes is not None:
+            response["routes"] = routes
+        if payload.get("execute", True):
+            try:
+                response["result"] = await loop.run_in_executor(self.db_pool, self._execute, db_id, sql)
+            except Exception as exc:
+                response["error"] = f"Error executing query: {exc}"
+        self.metrics.record("total", time.perf_counter() - start)
+        return response
+
+    def metrics_snapshot(self) -> Dict[str, Any]:
+        batches = self.batcher.batches
+        with self._contexts_lock:
+            dialogs = {db_id: ctx[1] for db_id, ctx in self._contexts.items()}
+        return {
+            "stages": self.metrics.snapshot(),
+            "batches": batches,
+            "mean_batch_size": self.batcher.requests / batches if batches else 0.0,
+            "keywords": {db_id: dialog.keyword_stats() for db_id, dialog in dialogs.items()},
+        }
+
+    async def route(self, method: str, path: str, body: bytes) -> Tuple[int, Dict[str, Any]]:
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok"}
+        if method == "GET" and path == "/metrics":
+            return 200, self.metrics_snapshot()
+        if method == "POST" and path == "/query":
+            try:
+                payload = json.loads(body or b"{}")
+                if not isinstance(payload, dict):
+                    return 400, {"error": "Invalid request: the body must be a JSON object."}
+                return 200, await self.handle_query(payload)
+            except (ValueError, KeyError, AttributeError) as exc:
+                return 400, {"error": f"Invalid request: {exc!r}"}
+            except FileNotFoundError as exc:
+                return 404, {"error": str(exc)}
+            except Exception as exc:
+                return 500, {"error": str(exc)}
+        return 404, {"error": f"No route for {method} {path}"}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serve one HTTP/1.1 request per connection."""
+        try:
+            request_line = (await reader.readline()).decode("latin-1")
+            method, path, _ = request_line.split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            status, payload = await self.route(method, path.split("?", 1)[0], body)
+        except (ValueError, asyncio.IncompleteReadError) as exc:
+            status, payload = 400, {"error": f"Malformed HTTP request: {exc}"}
+
+        data = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + data)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8000) -> None:
+        self.batcher.start()
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"FR2SQL service listening on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the FR2SQL pipeline over HTTP")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to bind")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument(
+        "--model", default="google/flan-t5-large", help="Model used by SimpleAgent"
+    )
+    parser.add_argument(
+        "--db-root", default=DB_BASE_PATH, help="Root directory of test databases"
+    )
+    parser.add_argument(
+        "--mode", default="normal", choices=["light", "normal", "advanced"], help="Linking mode"
+    )
+    parser.add_argument(
+        "--max-batch-size", type=int, default=8, help="Maximum prompts per generate call"
+    )
+    parser.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=5.0,
+        help="How long the batcher waits for more requests",
+    )
+    args = parser.parse_args()
+
+    from agent import SimpleAgent
+
+    service = FR2SQLService(
+        SimpleAgent(args.model),
+        db_root=args.db_root,
+        mode=args.mode,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+    )
+    asyncio.run(service.serve(args.host, args.port))
@@ -1,17 +1,25 @@
 from __future__ import annotations
 
 import os
+from typing import TYPE_CHECKING
 
 from tqdm import tqdm
 
-from agent.SpiderFRDataset import SpiderFRDataset
+from MemoryStore import MemoryStore
+
+if TYPE_CHECKING:
+    from agent.SpiderFRDataset import SpiderFRDataset
 
 
 def populate_dialog_memory(
     dataset: SpiderFRDataset,
     db_root: str = "databases/spider/test_database",
 ) -> None:
-    """Append each question to the dialog memory of its database."""
+    """Append each question to the dialog memory of its database.
+
+    Questions already present in a memory (ignoring case) are skipped, so the
+    function can be run repeatedly without accumulating duplicates.
+    """
 
     memories = {}
     for question, db_id in tqdm(
@@ -26,10 +34,11 @@ def populate_dialog_memory(
         if not os.path.exists(os.path.dirname(memory_path)):
             print(f"Found no directory for database {db_id}")
             continue
-        with open(memory_path, "a", encoding="utf-8") as f:
-            f.writelines(q + "\n" for q in questions)
+        MemoryStore(memory_path).extend(questions)
 
 if __name__ == "__main__":
+    from agent.SpiderFRDataset import SpiderFRDataset
+
     ds = SpiderFRDataset()
     populate_dialog_memory(ds)
 
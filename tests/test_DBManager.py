@@ -0,0 +1,100 @@
+import sqlite3
+
+import pytest
+
+from DBManager import DBManager, QueryGuardError
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "concerts.sqlite")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE singer (singer_id INTEGER PRIMARY KEY, name TEXT)")
+    conn.execute("CREATE TABLE concert (concert_id INTEGER PRIMARY KEY, singer_id INTEGER)")
+    conn.executemany("INSERT INTO singer VALUES (?, ?)", [(i, f"s{i}") for i in range(60)])
+    conn.executemany("INSERT INTO concert VALUES (?, ?)", [(i, i) for i in range(60)])
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def db(db_path):
+    manager = DBManager(db_path, explain_check=True, max_scan_rows=1000)
+    yield manager
+    manager.close()
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "SELECT * FROM singer, concert",
+        "SELECT * FROM singer AS T1, concert AS T2",
+        "SELECT * FROM singer T1 JOIN concert T2",
+        "SELECT * FROM singer AS T1 CROSS JOIN concert AS T2",
+    ],
+)
+def test_explain_flags_cross_join(db, query):
+    warnings = db.explain_query(query)
+    assert any("cross join of singer, concert" in w or "cross join of concert, singer" in w for w in warnings)
+
+
+def test_explain_accepts_indexed_join(db):
+    query = "SELECT T1.name FROM singer AS T1 JOIN concert AS T2 ON T1.singer_id = T2.concert_id"
+    assert db.explain_query(query) == []
+
+
+def count_singers(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM singer").fetchone()[0]
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("pool", [False, True])
+@pytest.mark.parametrize("method", ["execute_query", "stream_query"])
+def test_read_statement_never_writes(db_path, pool, method):
+    manager = DBManager(db_path, pool=pool)
+    try:
+        with pytest.raises(QueryGuardError):
+            getattr(manager, method)("WITH x AS (SELECT 1) DELETE FROM singer;")
+        assert count_singers(db_path) == 60
+        getattr(manager, method)("WITH x AS (SELECT 1) DELETE FROM singer;", allow_write=True)
+        assert count_singers(db_path) == 0
+    finally:
+        manager.close()
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "WITH x AS (SELECT 1) DELETE FROM singer;",
+        "WITH x AS (SELECT 100, 'new') INSERT INTO singer SELECT * FROM x;",
+        "DELETE FROM singer;",
+    ],
+)
+def test_read_only_rejects_writes(db_path, query):
+    manager = DBManager(db_path, pool=True, explain_check=True)
+    try:
+        with pytest.raises(QueryGuardError):
+            manager.execute_query(query, read_only=True, allow_write=True)
+        assert count_singers(db_path) == 60
+        assert manager.execute_query("SELECT COUNT(*) FROM singer", read_only=True)["rows"] == [(60,)]
+    finally:
+        manager.close()
+
+
+
+def test_row_count_uses_statistics(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("ANALYZE")
+    conn.execute("UPDATE sqlite_stat1 SET stat = '5000000' WHERE tbl = 'singer'")
+    conn.commit()
+    conn.close()
+    manager = DBManager(db_path, explain_check=True, max_scan_rows=1000)
+    try:
+        assert manager._row_count("singer") == 5_000_000
+        assert manager.explain_query("SELECT * FROM singer") == ["full scan of singer (5000000 rows)"]
+    finally:
+        manager.close()
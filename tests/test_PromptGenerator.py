@@ -0,0 +1,48 @@
+import re
+from types import SimpleNamespace
+
+import pytest
+
+from agent.PromptGenerator import fit_schema_to_budget, generate_sql_prompt
+
+
+class WordTokenizer:
+    """Counts words and punctuation marks as tokens."""
+
+    model_max_length = 10_000
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, text, add_special_tokens=True):
+        self.calls += 1
+        return SimpleNamespace(input_ids=re.findall(r"\w+|[^\w\s]", text))
+
+
+SCHEMA = {
+    "tables": [
+        {"name": f"table{t}", "columns": [f"column{c}" for c in range(30)]}
+        for t in range(4)
+    ]
+}
+
+
+def n_tokens(schema, tokenizer):
+    return len(tokenizer(generate_sql_prompt(schema, "How many rows?")).input_ids)
+
+
+def test_fits_budget_with_reserve():
+    tokenizer = WordTokenizer()
+    budget = n_tokens({"tables": SCHEMA["tables"][:2]}, tokenizer)
+    tokenizer.calls = 0
+    pruned = fit_schema_to_budget(SCHEMA, "How many rows?", tokenizer, budget + 50, reserve_tokens=50)
+    assert n_tokens(pruned, tokenizer) <= budget
+    assert pruned["tables"]
+    # Line costs are counted once, not the whole prompt per removed column
+    assert tokenizer.calls - 1 <= 2 + 4 + 4 * 30 + 2
+
+
+def test_warns_when_preamble_exceeds_budget():
+    with pytest.warns(UserWarning):
+        pruned = fit_schema_to_budget(SCHEMA, "How many rows?", WordTokenizer(), 20)
+    assert pruned == {"tables": []}
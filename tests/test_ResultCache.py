@@ -0,0 +1,44 @@
+import ResultCache as result_cache
+from ResultCache import ResultCache, normalize_sql
+
+
+import re
+
+
+def spider_like_tokenize(sql):
+    # Like Spider's tokenize: quotes become ", quoted values stay whole tokens
+    # and everything else is lowercased and split around punctuation
+    sql = sql.replace("'", '"')
+    assert sql.count('"') % 2 == 0, "Unexpected quote"
+    return [
+        tok if tok.startswith('"') else tok.lower()
+        for tok in re.findall(r'"[^"]*"|[!<>]=|\w+|\S', sql)
+    ]
+
+
+def test_normalize_keeps_quote_characters(monkeypatch):
+    monkeypatch.setattr(result_cache, "_tokenize", spider_like_tokenize)
+    literal = normalize_sql("SELECT * FROM singer WHERE name = 'name'")
+    column = normalize_sql('SELECT * FROM singer WHERE name = "name"')
+    assert literal != column
+    assert normalize_sql("SELECT * FROM singer WHERE name = 'name'", keep_quotes=False) == column
+
+
+def test_normalize_tokenizes_quoted_queries(monkeypatch):
+    monkeypatch.setattr(result_cache, "_tokenize", spider_like_tokenize)
+    assert normalize_sql("SELECT * FROM singer WHERE name='Joe'") == normalize_sql(
+        "select *  from singer where name = 'Joe';"
+    )
+    # Unbalanced quotes are rejected by the tokenizer: whitespace is collapsed instead
+    assert normalize_sql("SELECT  'x") == "SELECT 'x"
+
+
+def test_normalize_collapses_whitespace():
+    assert normalize_sql("SELECT  name\nFROM singer;") == normalize_sql("SELECT name FROM singer")
+
+
+def test_quoted_queries_do_not_share_entries():
+    cache = ResultCache(max_bytes=1 << 20)
+    literal = cache.key("SELECT * FROM singer WHERE name = 'name'", (), None, 0)
+    column = cache.key('SELECT * FROM singer WHERE name = "name"', (), None, 0)
+    assert literal != column
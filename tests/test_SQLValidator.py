@@ -0,0 +1,70 @@
+import pytest
+
+from agent.SQLValidator import SQLPrefixValidator
+
+SCHEMA = {
+    "singer": ["singer_id", "name", "country", "age"],
+    "concert": ["concert_id", "singer_id", "year"],
+}
+
+VALID = [
+    "SELECT count(*) FROM singer",
+    "SELECT DISTINCT name FROM singer WHERE age BETWEEN 20 AND 30 ORDER BY age DESC LIMIT 3",
+    "SELECT T1.name FROM singer AS T1 JOIN concert AS T2 ON T1.singer_id = T2.singer_id "
+    "GROUP BY T1.singer_id HAVING count(*) > 1",
+    "SELECT name FROM singer WHERE age NOT IN (SELECT age FROM singer WHERE country = 'France')",
+    "SELECT name FROM singer UNION SELECT name FROM singer WHERE name LIKE '%a%'",
+    "WITH old AS (SELECT * FROM singer WHERE age > 60) SELECT count(*) FROM old",
+    "SELECT CASE WHEN age > 30 THEN 'old' ELSE 'young' END FROM singer WHERE name IS NOT NULL",
+]
+
+INVALID = [
+    "SELECT",
+    "FROM singer SELECT",
+    "SELECT name name FROM FROM singer",
+    "SELECT name FROM singer WHERE",
+    "SELECT name FROM",
+    "SELECT name FROM singer ORDER age",
+    "SELECT name FROM singer LIMIT 1 WHERE age > 3",
+    "SELECT nickname FROM singer",
+]
+
+
+@pytest.fixture(scope="module")
+def validator():
+    return SQLPrefixValidator(SCHEMA)
+
+
+@pytest.mark.parametrize("sql", VALID)
+def test_valid_prefixes_stay_open(validator, sql):
+    for end in range(1, len(sql)):
+        assert validator.state(sql[:end]) == "open", sql[:end]
+    assert validator.state(sql + ";") == "complete"
+    assert validator.can_end(sql)
+
+
+@pytest.mark.parametrize("sql", INVALID)
+def test_invalid_statements_cannot_end(validator, sql):
+    assert validator.state(sql + ";") is None
+    assert not validator.can_end(sql)
+
+
+@pytest.mark.parametrize(
+    "prefix",
+    [
+        "FROM",
+        "SELECT name FROM singer WHERE WHERE",
+        "SELECT name age FROM singer",
+        "SELECT name FROM singer GROUP name",
+        "SELECT name FROM singer ORDER BY age WHERE",
+        "SELECT name FROM singer;  SELECT",
+    ],
+)
+def test_invalid_prefixes_are_masked(validator, prefix):
+    assert validator.state(prefix) is None
+
+
+def test_complete_statement_must_prepare(validator):
+    # Syntactically whole, but T3 is never declared
+    assert validator.state("SELECT T3.name FROM singer AS T1") == "open"
+    assert validator.state("SELECT T3.name FROM singer AS T1;") is None
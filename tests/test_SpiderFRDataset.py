@@ -0,0 +1,47 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from agent.SpiderFRDataset import PackedCollator  # noqa: E402
+
+
+def packed_row(*examples):
+    """A packed row as PackedCausalDataset builds it."""
+    return {
+        "input_ids": torch.cat(examples),
+        "labels": torch.cat([torch.cat([torch.tensor([-100]), e[1:]]) for e in examples]),
+        "position_ids": torch.cat([torch.arange(len(e)) for e in examples]),
+    }
+
+
+def test_collator_flattens_rows():
+    rows = [packed_row(torch.arange(1, 4), torch.arange(4, 6)), packed_row(torch.arange(6, 10))]
+    batch = PackedCollator()(rows)
+    assert batch["input_ids"].shape == (1, 9)
+    assert batch["position_ids"].tolist() == [[0, 1, 2, 0, 1, 0, 1, 2, 3]]
+    assert batch["labels"][0, 3] == -100
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="flash-attention 2 needs CUDA")
+def test_packed_logits_match_unpacked():
+    pytest.importorskip("flash_attn")
+    from transformers import LlamaConfig, LlamaForCausalLM
+
+    config = LlamaConfig(
+        vocab_size=128, hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+        num_attention_heads=4, num_key_value_heads=4, max_position_embeddings=64,
+    )
+    torch.manual_seed(0)
+    model = LlamaForCausalLM(config).to("cuda", torch.bfloat16).eval()
+    model.config._attn_implementation = "flash_attention_2"
+
+    first, second, third = (torch.randint(1, 128, (n,)) for n in (7, 5, 9))
+    batch = PackedCollator()([packed_row(first, second), packed_row(third)])
+    with torch.no_grad():
+        packed = model(
+            input_ids=batch["input_ids"].cuda(), position_ids=batch["position_ids"].cuda()
+        ).logits[0]
+        alone = model(input_ids=second.unsqueeze(0).cuda()).logits[0]
+    # The second example of the first row must not see the first example
+    torch.testing.assert_close(packed[7:12].float(), alone.float(), atol=2e-2, rtol=2e-2)
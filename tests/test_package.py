@@ -0,0 +1,20 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(__file__), os.pardir)
+
+
+def run(code):
+    return subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+
+
+def test_import_src_loads_no_model_library():
+    proc = run("import sys, src; print(any(m in sys.modules for m in ('torch', 'transformers')))")
+    assert proc.returncode == 0, proc.stderr
+    assert proc.stdout.strip() == "False"
+
+
+def test_lazy_exports_resolve_from_repo_root():
+    proc = run("import src; cls = src.DBManager; import DBManager; assert cls is DBManager.DBManager; src.get_registry")
+    assert proc.returncode == 0, proc.stderr